@@ -0,0 +1,75 @@
+"""Benchmarks for prettymatrix.
+
+Run with:
+
+    python benchmark_prettymatrix.py
+"""
+import concurrent.futures
+import time
+import timeit
+
+import numpy as np
+
+import prettymatrix
+
+
+def _time(function, number=100, repeat=5):
+    """Return the best time, in seconds, of a single call to function."""
+    return min(timeit.repeat(function, number=number, repeat=repeat)) / number
+
+
+def benchmark_colour():
+    """Compare coloured and monochrome rendering of an expression."""
+    random = np.random.RandomState(0)
+    A, B = random.normal(size=(500, 300)), random.normal(size=(300, 400))
+    expression = (A, prettymatrix.DOT, B, prettymatrix.EQUALS, A.dot(B))
+
+    def render(colour):
+        return prettymatrix.expression_to_string(*expression,
+                                                 names=['A', 'B', 'C'],
+                                                 include_dimensions=True,
+                                                 colour=colour)
+
+    monochrome = _time(lambda: render(False))
+    coloured = _time(lambda: render(True))
+
+    print('expression_to_string: {:.3f}ms monochrome, {:.3f}ms coloured '
+          '({:+.1f}%)'.format(1000 * monochrome, 1000 * coloured,
+                              100 * (coloured / monochrome - 1)))
+
+
+def benchmark_threads(thread_counts=(1, 2, 4, 8, 16), renders=2000):
+    """Measure matrix_to_string throughput from a pool of threads.
+
+    Each render reads and stringifies only the displayed corners of its
+    matrix, so throughput scales with threads only as far as NumPy releases
+    the GIL (or on a free-threaded build of CPython).
+    """
+    random = np.random.RandomState(0)
+    matrices = [random.normal(size=(1000, 1000)) for _ in range(16)]
+
+    def render(i):
+        return prettymatrix.matrix_to_string(matrices[i % len(matrices)],
+                                             name='M', include_dimensions=True)
+
+    baseline = None
+    for threads in thread_counts:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+            list(executor.map(render, range(threads)))
+            start = time.perf_counter()
+            list(executor.map(render, range(renders)))
+            elapsed = time.perf_counter() - start
+
+        throughput = renders / elapsed
+        baseline = baseline or throughput
+        print('matrix_to_string: {:2d} threads, {:.0f} renders/s '
+              '({:.2f}x)'.format(threads, throughput, throughput / baseline))
+
+
+def main():
+    benchmark_colour()
+    benchmark_threads()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,17 @@
+import argparse
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import html
 import itertools
+import os
+import re
+import sys
+import threading
+import time
+import zipfile
 
 import numpy as np
 
@@ -18,13 +31,201 @@ _BORDER = '│'
 
 _ELLIPSIS = '…'
 
+_TRANSPOSE = 'ᵀ'
+_INVERSE = '⁻¹'
+
 _MAX_HEIGHT = _MAX_WIDTH = 10
 _SHRUNK_NUM_ROWS = _SHRUNK_NUM_COLS = 3
 
+# The largest (height, width) displayed without elision. Held in a context
+# variable, so that printoptions applies only to the current thread or task.
+_DISPLAY_LIMITS = contextvars.ContextVar('prettymatrix_display_limits',
+                                         default=(_MAX_HEIGHT, _MAX_WIDTH))
+
+_SHADES = ' ░▒▓█'
+_NON_FINITE_SHADE = '?'
+_HEATMAP_STATISTICS = ('mean', 'max', 'absmax')
+
+# Upper bound on the number of elements read into memory at once when
+# streaming over a (possibly memory-mapped) matrix.
+_CHUNK_SIZE = 2 ** 20
+
+_MARGIN_STATISTICS = ('min', 'max', 'mean', 'norm', 'nans')
+_MARGIN_COLUMN_SEPARATOR = '│'
+_MARGIN_ROW_SEPARATOR = '─'
+_MARGIN_CROSS = '┼'
+
+_DIFF_MARKER = '*'
+
+_MASKED = '--'
+
+_MARKER_KINDS = ('nans', 'infs', 'outliers')
+_MARKERS = ('?', '!', '^')
+
+# Formatters for the cells of object arrays, by type.
+_OBJECT_FORMATTERS = {}
+
+# Bumped on every formatter registration, so that formatters looked up (and
+# cached) concurrently with a registration are never used after it.
+_FORMATTER_GENERATION = 0
+
+# (predicate, read_blocks) pairs, most recently registered first.
+_READERS = []
+
+# Guards every change to the formatter and reader registries.
+_REGISTRY_LOCK = threading.Lock()
+
+# Size of the blocks in which text files are scanned.
+_TEXT_BLOCK_SIZE = 2 ** 16
+
+_TEXT_DELIMITERS = {'.csv': ',', '.tsv': '\t', '.txt': None}
+
+# The first bytes of an .npz archive; like np.load, we look no further.
+_ZIP_MAGIC = b'PK\x03\x04'
+
+# A matrix or operator, formatted but not yet serialized by a backend.
+# Headers are listed top to bottom; unframed items are operators, and have no
+# shape.
+_MatrixLayout = collections.namedtuple('_MatrixLayout',
+                                       ['cells', 'widths', 'headers', 'framed',
+                                        'shape'])
+
+# Escape sequences are built once, so colouring costs no more than a lookup.
+_ESCAPE = '\x1b'
+_ANSI_ESCAPE_SEQUENCE = re.compile(r'(\x1b\[[0-9;]*m)')
+_PALETTE = tuple('\x1b[{}m'.format(code) for code in (31, 32, 33, 34, 35, 36))
+_RESET = '\x1b[0m'
+
+_LATEX_OPERATORS = {DOT: r'\cdot', HADAMARD: r'\circ'}
+_LATEX_SPECIAL_CHARACTERS = {c: '\\' + c for c in '&%$#_{}'}
+# Escapes that are valid only in text mode.
+_LATEX_TEXT_ESCAPES = {'\\': r'\textbackslash{}', '^': r'\textasciicircum{}',
+                       '~': r'\textasciitilde{}'}
+_LATEX_SPECIAL_CHARACTERS.update(_LATEX_TEXT_ESCAPES)
+_LATEX_SUPERSCRIPTS = {_TRANSPOSE: '^{T}', _INVERSE: '^{-1}'}
+
+
+def read_text(path, delimiter=',', num_rows=None):
+    """Return the displayed cells of a delimited text matrix stored at path.
+
+    The result can be passed to matrix_to_string and friends, but does not
+    support margins, heatmaps or diffs, which need every cell. A delimiter of
+    None splits rows on whitespace. Fields are kept as text, and quoted fields
+    are not supported.
+
+    Only the first rows of the file are read forwards, and the last rows by
+    seeking backwards from its end. Of each, only the first and last fields
+    are split out. Blank lines at the end of the file are not rows.
+
+    If the file has more rows than can be displayed, they are counted by
+    scanning (but not parsing) the whole file, so reading a tall file costs
+    I/O in proportion to its size unless num_rows is given. The cells kept
+    are those displayed under the printoptions in effect when the file is
+    read.
+    """
+    max_height, _ = _DISPLAY_LIMITS.get()
+
+    with open(path, 'rb') as f:
+        head = _read_head(f, max_height + 1)
+
+        if _only_line_endings_remain(f):
+            while head and not head[-1]:
+                head.pop()
 
-def matrix_to_string(M, name=None, include_dimensions=False):
-    """Stringify a 2D matrix, M."""
-    return _render(_format_matrix(M, name, include_dimensions))
+        if len(head) <= max_height:
+            lines, num_rows = head, len(head)
+        else:
+            lines = head[:_SHRUNK_NUM_ROWS] + _read_tail(f, _SHRUNK_NUM_ROWS)
+            num_rows = _count_lines(f) if num_rows is None else num_rows
+
+    lines = [line.decode('utf-8') for line in lines]
+    if not lines:
+        num_cols = 0
+    elif delimiter is None:
+        num_cols = len(lines[0].split())
+    else:
+        num_cols = lines[0].count(delimiter) + 1
+    cells = (np.array([_split_displayed_fields(line, delimiter, num_cols)
+                       for line in lines], dtype=str).reshape(len(lines), -1)
+             if lines else np.empty((0, 0), dtype=str))
+
+    return _TextMatrix(cells, (num_rows, num_cols))
+
+
+def register_formatter(cls, format_cell):
+    """Register how to stringify cells of type cls in object arrays.
+
+    format_cell is called with a single cell and must return a string. It is
+    also used for subclasses of cls, unless they have a formatter of their
+    own. Formatters are looked up once per type, and cached.
+    """
+    global _FORMATTER_GENERATION
+
+    with _REGISTRY_LOCK:
+        _OBJECT_FORMATTERS[cls] = format_cell
+        _FORMATTER_GENERATION += 1
+        _object_formatter.cache_clear()
+
+
+def register_reader(predicate, read_blocks):
+    """Register a batched reader for the displayed corners of lazy arrays.
+
+    For any matrix M where predicate(M) is true, read_blocks(M, row_slices,
+    col_slices) is called instead of slicing M once per displayed block. It
+    must return the cells of every (rows, cols) block as one array, with
+    blocks assembled in order. Later registrations take precedence.
+
+    Readers for Dask and Zarr arrays are registered by default.
+    """
+    with _REGISTRY_LOCK:
+        _READERS.insert(0, (predicate, read_blocks))
+
+
+@contextlib.contextmanager
+def printoptions(max_height=None, max_width=None):
+    """Temporarily change the largest matrix displayed without elision.
+
+    Matrices with more than max_height rows or max_width columns are capped
+    as usual, to their first and last three rows or columns. Options are held
+    in a context variable, so they apply only within the current thread (or
+    asyncio task) and are safe to use while other threads render.
+    """
+    height, width = _DISPLAY_LIMITS.get()
+    height = height if max_height is None else max_height
+    width = width if max_width is None else max_width
+
+    if height < 2 * _SHRUNK_NUM_ROWS or width < 2 * _SHRUNK_NUM_COLS:
+        raise ValueError("Display limits must be at least {}x{}".format(
+            2 * _SHRUNK_NUM_ROWS, 2 * _SHRUNK_NUM_COLS))
+
+    token = _DISPLAY_LIMITS.set((height, width))
+    try:
+        yield
+    finally:
+        _DISPLAY_LIMITS.reset(token)
+
+
+def matrix_to_string(M, name=None, include_dimensions=False, margins=None,
+                     workers=None, markers=False, threshold=None):
+    """Stringify a 2D matrix, M.
+
+    Optionally, margins names a sequence of statistics, drawn from 'min',
+    'max', 'mean', 'norm' and 'nans', to append as extra columns (one
+    statistic per displayed row) and extra rows (one per displayed column).
+    Statistics ignore NaNs (and masked cells, which count as NaN), except for
+    'nans' which counts them. A header row summarizes the same statistics over
+    the whole of M.
+
+    If markers is true, displayed cells holding NaN are suffixed with '?',
+    infinities with '!', and finite values whose magnitude exceeds threshold
+    (if given) with '^'. A header row counts each across the whole of M, and
+    gives the location of the first.
+
+    Margins and markers are each computed in a single streaming pass over
+    chunks of rows of M, optionally spread across a pool of workers threads.
+    """
+    return Layout([_format_matrix(M, name, include_dimensions, margins,
+                                  workers, markers, threshold)]).render()
 
 
 def matrices_to_string(*seq, names=None, include_dimensions=False):
@@ -42,14 +243,11 @@ def matrices_to_string(*seq, names=None, include_dimensions=False):
     formatted = [_format_matrix(M, name=name or name_fallback, include_dimensions=include_dimensions)
                  for M, name in itertools.zip_longest(seq, names or [])]
 
-    num_rows = max(M.shape[0] for M in formatted)
-    padded = [_pad_horizontally(M, top_padding=0, bottom_padding=num_rows - M.shape[0]) for M in formatted]
-    widths = [M.shape[1] for M in padded]
-    x = _space_columns(np.concatenate(padded, axis=1), widths)
-    return _render(x)
+    return Layout(formatted).render()
 
 
-def expression_to_string(*seq, names=None, include_dimensions=False):
+def expression_to_string(*seq, names=None, include_dimensions=False,
+                         colour=False, evaluate=False):
     """Stringify an expression, comprising matrices and operators.
 
     Operators can be any string, but for convenience the following are defined:
@@ -59,10 +257,29 @@ def expression_to_string(*seq, names=None, include_dimensions=False):
     prettymatrix.PLUS
     prettymatrix.MINUS
     prettymatrix.EQUALS
+
+    Matrices can be transposed, inverted or wrapped in functions with T, inv
+    and apply. By default these are drawn around the original matrix; if
+    evaluate is true, the resulting matrix is drawn instead.
+
+    If colour is true, matching dimensions are highlighted in the same colour
+    using ANSI escape sequences.
+    """
+    return layout(*seq, names=names, include_dimensions=include_dimensions,
+                  evaluate=evaluate).render('ansi' if colour else 'text')
+
+
+def layout(*seq, names=None, include_dimensions=False, evaluate=False):
+    """Return the Layout of an expression, comprising matrices and operators.
+
+    Arguments are as for expression_to_string; a single matrix is an
+    expression too. The returned Layout can be serialized as text, HTML,
+    LaTeX or Markdown while formatting the matrices only once.
     """
     # Expand the names array with Nones such that its the same length as the
     # input sequence.
     if names:
+        names = list(names)
         for i, M in enumerate(seq):
             if isinstance(M, str):
                 names.insert(i, None)
@@ -72,49 +289,421 @@ def expression_to_string(*seq, names=None, include_dimensions=False):
                           "equal to number of matrices"))
 
     # Dynamically format an item in the input sequence depending on whether its
-    # a matrix or an operator (a string).
+    # a matrix, an operator (a string) or a function of a matrix.
     def _format(M, name=None, include_dimensions=False):
+        height = int(bool(name)) + int(bool(include_dimensions))
+
         if isinstance(M, str):
-            height = int(bool(name)) + int(bool(include_dimensions))
-            return np.concatenate((np.full((height, 1), _PAD), np.full((1, 1),
-                M)), axis=0)
+            return [_format_operator(M, height)]
+        elif isinstance(M, _Node) and evaluate:
+            name = M.notation(name) if name and name.strip() else name
+            return [_format_matrix(M, name=name, include_dimensions=include_dimensions)]
+        elif isinstance(M, _Node):
+            prefix, operand, suffix = M.unwrap()
+            return ([_format_operator(prefix, height) for _ in prefix[:1]] +
+                    _format(operand, name=name, include_dimensions=include_dimensions) +
+                    [_format_operator(suffix, height) for _ in suffix[:1]])
         else:
-            return _format_matrix(M, name=name, include_dimensions=include_dimensions)
+            return [_format_matrix(M, name=name, include_dimensions=include_dimensions)]
 
     # A bit of a hack: if any names are specified at all, we must pad any
     # matrix with an empty name if it doesn't have one specified. Otherwise, it
     # will be missing a row.
     name_fallback = ' ' if names else None
 
-    formatted = [_format(M, name=name or name_fallback, include_dimensions=include_dimensions)
-                 for M, name in itertools.zip_longest(seq, names or [])]
-    num_rows = max(M.shape[0] for M in formatted)
-    padded = [_pad_horizontally(M, top_padding=0, bottom_padding=num_rows - M.shape[0]) for M in formatted]
-    widths = [M.shape[1] for M in padded]
-    return _render(_space_columns(np.concatenate(padded, axis=1), widths)) 
+    return Layout([item for M, name in itertools.zip_longest(seq, names or [])
+                   for item in _format(M, name=name or name_fallback,
+                                       include_dimensions=include_dimensions)])
+
+
+def T(M):
+    """Return the transpose of M, for use in an expression.
+
+    Only the cells that are displayed are ever read, and they are transposed
+    as a view rather than copied.
+    """
+    M = _as_matrix(M)
+    return _Node(M, tuple(M.shape[::-1]), '', _TRANSPOSE,
+                 lambda rows, cols: np.asanyarray(M[cols, rows]).T)
+
+
+def inv(M):
+    """Return the inverse of M, for use in an expression.
 
+    Unlike T and apply, the inverse can't be found from the displayed cells
+    alone: if its cells are displayed, all of M is read and inverted, once
+    for as long as the displayed cells of M are unchanged. Masked cells are
+    inverted as NaN.
+    """
+    M = _as_matrix(M)
+
+    @functools.lru_cache(maxsize=1)
+    def inverse(version):
+        A = np.asanyarray(M[:, :])
+        return np.linalg.inv(
+            _dense_rows(A, 0, None, complex if A.dtype.kind == 'c' else float))
+
+    return _Node(M, tuple(M.shape), '', _INVERSE,
+                 lambda rows, cols: inverse(_data_version(M))[rows, cols])
+
+
+def apply(function, M):
+    """Return an element-wise function of M, for use in an expression.
+
+    function is either the name of a numpy ufunc, such as 'tanh', or any
+    vectorized callable. It is only ever evaluated on the displayed cells.
+    """
+    M = _as_matrix(M)
+    if isinstance(function, str):
+        name, function = function, getattr(np, function)
+    else:
+        name = function.__name__
+
+    return _Node(M, tuple(M.shape), name + '(', ')',
+                 lambda rows, cols: function(np.asanyarray(M[rows, cols])))
+
+
+class _Node(object):
+    """A lazily evaluated function of a matrix, M.
+
+    A node has a shape and supports slicing, like any matrix, but computes
+    only the cells that are sliced from it. Nodes may be nested.
+    """
+
+    def __init__(self, M, shape, prefix, suffix, read):
+        self.shape = shape
+        self._M = M
+        self._prefix = prefix
+        self._suffix = suffix
+        self._read = read
+
+    def __getitem__(self, key):
+        rows, cols = key if isinstance(key, tuple) else (key, slice(None))
+        return self._read(rows, cols)
+
+    def __array__(self, dtype=None, copy=None):
+        return np.asarray(self[:, :], dtype=dtype)
+
+    def notation(self, name):
+        """Return the notation for this node applied to a matrix called name."""
+        if isinstance(self._M, _Node):
+            name = self._M.notation(name)
+        return self._prefix + name + self._suffix
+
+    def unwrap(self):
+        """Return the notation either side of the innermost matrix, and it."""
+        if not isinstance(self._M, _Node):
+            return self._prefix, self._M, self._suffix
+
+        prefix, M, suffix = self._M.unwrap()
+        return self._prefix + prefix, M, suffix + self._suffix
+
+
+class Layout(object):
+    """A formatted expression, ready to be serialized by any backend.
+
+    All of the formatting work, including capping, stringifying and measuring
+    cells, happens once when the layout is built. Each backend's output is
+    then produced on first request, and cached. A layout may be rendered from
+    many threads at once; if they race, a backend may run more than once, but
+    all of them see the same cached output.
+    """
+
+    def __init__(self, items):
+        self.items = items
+        self._rendered = {}
+
+    def render(self, backend='text'):
+        """Serialize the layout as 'text', 'ansi', 'html', 'latex' or 'markdown'.
+
+        The 'ansi' backend is text with matching dimensions highlighted in the
+        same colour.
+        """
+        if backend not in _BACKENDS:
+            raise ValueError("Backend must be one of {}".format(
+                ', '.join(sorted(_BACKENDS))))
+
+        rendered = self._rendered.get(backend)
+        if rendered is None:
+            rendered = self._rendered.setdefault(
+                backend, _BACKENDS[backend](self.items))
+
+        return rendered
+
+    def __str__(self):
+        return self.render()
+
+
+def diff_to_string(A, B, names=None, include_dimensions=False, atol=1e-8,
+                   rtol=1e-5, workers=None):
+    """Stringify two equally-shaped 2D matrices, A and B, marking differences.
+
+    A and B are rendered side by side with shared column widths, and every
+    displayed cell where they are not close (see numpy.isclose) is marked with
+    a trailing '*'. A header row reports the number of mismatched cells and the
+    largest absolute error across the whole of both matrices.
+
+    The comparison streams over chunks of rows, optionally spread across a pool
+    of workers threads, so A - B is never materialized in full.
+    """
+    A, B = _as_matrix(A), _as_matrix(B)
+    if A.shape != B.shape:
+        raise ValueError("Matrices must have the same shape, got {} and {}".format(
+            A.shape, B.shape))
+
+    if names and len(names) > 2:
+        raise ValueError(("Number of names must be less than or "
+                          "equal to number of matrices"))
 
-def _format_matrix(M, name=None, include_dimensions=False):
-    """Return a copy of M with all formatting steps applied.
+    num_rows, num_cols = A.shape
+    corners_A, corners_B = _corners(A), _corners(B)
+    dtype = _comparison_dtype(corners_A, corners_B)
+    differs = ~np.isclose(_dense_rows(corners_A, 0, None, dtype),
+                          _dense_rows(corners_B, 0, None, dtype),
+                          rtol=rtol, atol=atol, equal_nan=True)
+
+    def mark(corners):
+        cells = _cells_to_string(corners)
+        return _cap_width(_cap_height(
+            np.where(differs, np.char.add(cells, _DIFF_MARKER), cells),
+            num_rows), num_cols)
+
+    cells_A, cells_B = mark(corners_A), mark(corners_B)
+    normalized, widths = _normalize_all_cells(np.concatenate((cells_A, cells_B)))
+    halves = np.split(normalized, [cells_A.shape[0]])
+
+    name_fallback = ' ' if names else None
+    formatted = [_annotate(_border(_pad(_space_columns(half, widths))),
+                           A.shape, name or name_fallback, include_dimensions)
+                 for half, name in itertools.zip_longest(halves, names or [])]
+
+    mismatches, max_error = _compare(A, B, rtol, atol, dtype, workers)
+    header = 'mismatches={}/{}, max_abs_error={}'.format(
+        mismatches, A.size, _format_statistic(max_error))
+
+    return _render(_prepend_string_row(_side_by_side(formatted), header))
+
+
+def heatmap_to_string(M, name=None, include_dimensions=False,
+                      statistic='mean', height=_MAX_HEIGHT, width=_MAX_WIDTH):
+    """Stringify a 2D matrix, M, as a grid of shaded blocks.
+
+    Rather than eliding the middle of M, we divide it into at most
+    (height x width) blocks and reduce each block to a single statistic, one of
+    'mean', 'max' or 'absmax'. Blocks are shaded relative to the smallest and
+    largest statistic; blocks containing NaN, infinity or masked cells are
+    drawn as '?'.
+
+    M is read a chunk of rows at a time, so memory-mapped matrices larger than
+    memory can be summarized.
+    """
+    if statistic not in _HEATMAP_STATISTICS:
+        raise ValueError("Statistic must be one of {}".format(
+            ', '.join(_HEATMAP_STATISTICS)))
+
+    if height < 1 or width < 1:
+        raise ValueError("Height and width must be positive, got {} and {}".format(
+            height, width))
+
+    M = _as_matrix(M)
+    N = _border(_pad(_shade(_block_statistics(M, statistic, height, width))))
+    return _render(_annotate(N, M.shape, name, include_dimensions))
+
+
+class PrettyMatrix(object):
+    """An expression that displays itself richly in IPython and Jupyter.
+
+    Arguments are as for expression_to_string. Text, HTML and LaTeX
+    representations share a single Layout, and each is computed on first
+    display. The layout is rebuilt only when the displayed data changes,
+    which is detected by comparing the shape and displayed cells of every
+    matrix, rather than by reformatting. Cells of object arrays, which may be
+    mutated in place, are compared by their formatted text. Unless evaluate
+    is true, the matrices wrapped by T, inv and apply are compared, rather
+    than the results, which are never computed.
+    """
+
+    def __init__(self, *seq, names=None, include_dimensions=False,
+                 colour=False, evaluate=False):
+        self._seq = seq
+        self._names = names
+        self._include_dimensions = include_dimensions
+        self._colour = colour
+        self._evaluate = evaluate
+        # (version, layout), swapped as one so that threads never pair a
+        # version with another version's layout.
+        self._cached = (None, None)
+
+    def _current_layout(self):
+        """Return the layout of the expression, rebuilding it if stale."""
+        version = tuple(self._item_version(item) for item in self._seq)
+
+        cached_version, cached_layout = self._cached
+        if cached_layout is None or version != cached_version:
+            cached_layout = layout(*self._seq, names=self._names,
+                                   include_dimensions=self._include_dimensions,
+                                   evaluate=self._evaluate)
+            self._cached = (version, cached_layout)
+
+        return cached_layout
+
+    def _item_version(self, item):
+        """Return a fingerprint of an item of the expression, as displayed."""
+        if isinstance(item, str):
+            return item
+        elif isinstance(item, _Node) and not self._evaluate:
+            return _data_version(item.unwrap()[1])
+
+        return _data_version(item)
+
+    def __str__(self):
+        return self._current_layout().render('ansi' if self._colour else 'text')
+
+    def _repr_pretty_(self, p, cycle):
+        p.text(str(self))
+
+    def _repr_html_(self):
+        return self._current_layout().render('html')
+
+    def _repr_latex_(self):
+        return '$${}$$'.format(self._current_layout().render('latex'))
+
+
+def _data_version(M):
+    """Return a fingerprint of everything about M that affects its display."""
+    M = _as_matrix(M)
+    corners = _corners(M)
+
+    # The bytes of an object array are pointers, which stay the same when a
+    # cell is mutated in place, so objects are compared by their display.
+    if corners.dtype.hasobject:
+        return tuple(M.shape), corners.dtype.str, _cells_to_string(corners).tobytes()
+
+    return tuple(M.shape), corners.dtype.str, corners.tobytes()
+
+
+def _format_matrix(M, name=None, include_dimensions=False, margins=None,
+                   workers=None, markers=False, threshold=None):
+    """Return the layout of M, with all backend-independent formatting applied.
 
     This includes:
-    * Split the contents of every cell to contain at most one character
-    * Add a column of padding between every two columns
-    * Wrap the entire matrix in padding
-    * Add typical matrix-notation bracketing
+    * Stringify every displayed cell
+    * Optionally mark non-finite and outlying cells, and add a summary header
     * Replace internal rows and columns with ellipses if matrix is too large
-    * Optionally prepend a row containing the matrix's dimensions
-    * Optionally prepend a name row to the matrix
+    * Measure the width of every column
+    * Optionally append row and column statistics, and add a summary header
+    * Optionally add a header containing the matrix's dimensions
+    * Optionally add a name header to the matrix
+
+    Splitting, spacing, padding and bracketing the cells is left to the
+    backend; see _text_item.
     """
-    N = _border(
-            _pad(
-            _space_columns(
-            *_normalize_all_cells(
-            _cells_to_string(
-            _cap_dimensions(M))))))
+    M = _as_matrix(M)
+    cells = _cap_dimensions(M, threshold if markers else None, markers)
+    headers = [name, '({}x{})'.format(*M.shape) if include_dimensions else None]
+
+    if margins:
+        row_stats, col_stats, global_stats = _margin_statistics(M, margins, workers)
+        exact = _exact_statistics(M, margins)
+        cells = _append_margins(cells, M.shape, margins, row_stats, col_stats,
+                                exact)
+        headers.append(', '.join(
+            '{}={}'.format(stat, _format_statistic(value, is_exact))
+            for stat, value, is_exact in zip(margins, global_stats, exact)))
+
+    if markers:
+        headers.append(', '.join(
+            '{}={}'.format(kind, count) +
+            (' at ({}, {})'.format(*first) if count else '')
+            for kind, count, first in _scan_markers(M, threshold, workers)))
+
+    return _MatrixLayout(cells, _column_widths(cells),
+                         [header for header in headers if header], True,
+                         tuple(M.shape))
+
+
+def _format_operator(operator, height=0):
+    """Return the layout of an operator, beneath height blank header rows."""
+    return _MatrixLayout(np.full((1, 1), operator), [len(operator)],
+                         [_PAD] * height, False, None)
+
+
+def _column_widths(cells):
+    """Return the length of the longest string in each column of cells."""
+    return np.max(np.vectorize(_visible_len, otypes=[int])(cells), axis=0, initial=0)
+
+
+def _characters(s):
+    """Split s into its visible characters.
+
+    Any ANSI escape sequences are attached to the visible character that
+    follows them, or to the last character if they end s, so that each
+    element occupies exactly one column on a terminal.
+    """
+    if _ESCAPE not in s:
+        return s
+
+    characters, pending = [], ''
+    for token in _ANSI_ESCAPE_SEQUENCE.split(s):
+        if _ANSI_ESCAPE_SEQUENCE.fullmatch(token):
+            pending += token
+            continue
+
+        for c in token:
+            characters.append(pending + c)
+            pending = ''
+
+    if characters:
+        characters[-1] += pending
+
+    return characters
+
+
+def _visible_len(s):
+    """Return the number of columns s occupies on a terminal."""
+    return len(s) if _ESCAPE not in s else len(_characters(s))
 
+
+def _as_matrix(M):
+    """Return M in a form that supports shape and slicing, without copying.
+
+    Arrays and tensors from most frameworks (PyTorch, JAX, CuPy, ...) already
+    support both, and are sliced before any conversion to a numpy array.
+    pandas DataFrames, whose own slicing is by label, are sliced by position.
+    Objects that only expose the array interface or DLPack (on NumPy 1.22 and
+    later) are wrapped as zero-copy numpy views; anything else is converted in
+    full.
+    """
+    if hasattr(M, 'iloc') and hasattr(M, 'shape'):
+        return _PositionalFrame(M)
+
+    if hasattr(M, 'shape') and hasattr(M, '__getitem__'):
+        return M
+
+    if hasattr(M, '__array_interface__'):
+        return np.asarray(M)
+
+    if hasattr(M, '__dlpack__') and hasattr(np, 'from_dlpack'):
+        return np.from_dlpack(M)
+
+    return np.asarray(M)
+
+
+class _PositionalFrame(object):
+    """A pandas DataFrame, sliced by position rather than by label."""
+
+    def __init__(self, frame):
+        self.shape = frame.shape
+        self._frame = frame
+
+    def __getitem__(self, key):
+        return np.asarray(self._frame.iloc[key])
+
+
+def _annotate(N, shape, name=None, include_dimensions=False):
+    """Optionally prepend dimension and name rows to a formatted matrix, N."""
     if include_dimensions:
-        N = _prepend_string_row(N, '({}x{})'.format(*M.shape))
+        N = _prepend_string_row(N, '({}x{})'.format(*shape))
 
     if name:
         N = _prepend_string_row(N, name)
@@ -122,6 +711,14 @@ def _format_matrix(M, name=None, include_dimensions=False):
     return N
 
 
+def _side_by_side(formatted):
+    """Return a sequence of formatted matrices joined left to right."""
+    num_rows = max(M.shape[0] for M in formatted)
+    padded = [_pad_horizontally(M, top_padding=0, bottom_padding=num_rows - M.shape[0]) for M in formatted]
+    widths = [M.shape[1] for M in padded]
+    return _space_columns(np.concatenate(padded, axis=1), widths)
+
+
 def _character_cell(c):
     """Return a (1x1) array wrapping character c."""
     return np.full((1,1), c)
@@ -223,7 +820,7 @@ def _normalize_cell_width(M, min_column_width=0):
 
     Note that M should be a matrix of size (1x1).
     """
-    split = np.concatenate([_character_cell(c) for c in M[0,0]], axis=1)
+    split = np.concatenate([_character_cell(c) for c in _characters(M[0,0])], axis=1)
     right_padding_size = max(0, min_column_width - split.shape[1])
     right_padding = _character_row(_PAD, right_padding_size)
     return np.concatenate((split, right_padding), axis=1)
@@ -240,18 +837,20 @@ def _normalize_column_width(M, min_column_width=0):
                            for i in range(0, M.shape[0])], axis=0)
 
 
-def _normalize_all_cells(M):
+def _normalize_all_cells(M, max_column_widths=None):
     """Return a matrix where every cell has had its contents normalized.
 
     By normalized, we mean that every cell containing a string s of length n,
-    is split into n cells, each containing a single character of s.
+    is split into n cells, each containing a single character of s. Columns
+    are padded to max_column_widths, if given, or else to their widest cell.
     """
     if M.shape == (0, 0):
         # Bit of a hack because we can't apply vectorized operations to 0x0
         # matrices.
         return M, np.full((0,0), 0)
 
-    max_column_widths = np.max(np.vectorize(len)(M), axis=0)
+    if max_column_widths is None:
+        max_column_widths = _column_widths(M)
 
     if M.shape[1] == 1:
         return _normalize_column_width(M, max_column_widths[0]), max_column_widths
@@ -281,10 +880,61 @@ def _space_columns(M, column_widths):
 
 
 def _cells_to_string(M):
-    """Return a matrix where every cell of M has been stringified."""
+    """Return a matrix where every cell of M has been stringified.
+
+    The formatter is chosen once for the whole of M, by its type and dtype.
+    """
+    if isinstance(M, np.ma.MaskedArray):
+        return _format_masked(M)
+
+    return _ARRAY_FORMATTERS.get(M.dtype.kind, _format_default)(M)
+
+
+def _format_default(M):
+    """Stringify every cell of M with numpy's own conversion."""
     return M.astype(str)
 
 
+def _format_masked(M):
+    """Stringify every cell of a masked array, M, hiding masked values."""
+    return np.where(np.ma.getmaskarray(M), _MASKED, _cells_to_string(M.data))
+
+
+def _format_complex(M):
+    """Stringify every cell of a complex array, M, as a+bj."""
+    signs = np.where(np.signbit(M.imag), '-', '+')
+    return np.char.add(np.char.add(np.char.add(M.real.astype(str), signs),
+                                   np.abs(M.imag).astype(str)), 'j')
+
+
+def _format_objects(M):
+    """Stringify every cell of an object array, M, by the type of each cell."""
+    return _format_object_cells(M).astype(str).reshape(M.shape)
+
+
+def _format_object(x):
+    """Stringify a single Python object with the formatter for its type."""
+    return _object_formatter(type(x), _FORMATTER_GENERATION)(x)
+
+
+_format_object_cells = np.frompyfunc(_format_object, 1, 1)
+
+
+@functools.lru_cache(maxsize=None)
+def _object_formatter(cls, generation):
+    """Return the formatter registered for cls or its nearest base class.
+
+    Lookups are cached per generation of the registry, so a lookup that races
+    with a registration is cached under the generation it read.
+    """
+    with _REGISTRY_LOCK:
+        for base in cls.__mro__:
+            if base in _OBJECT_FORMATTERS:
+                return _OBJECT_FORMATTERS[base]
+
+    return str
+
+
 def _prepend_string_row(M, string):
     """Prepend a new row containing string to the top of the matrix."""
     if not string:
@@ -297,20 +947,98 @@ def _prepend_string_row(M, string):
     return np.concatenate((string_row, padded), axis=0)
 
 
-def _cap_dimensions(M):
-    """Return a copy of M bounded to a fixed size.
+def _cap_dimensions(M, threshold=None, markers=False):
+    """Return a stringified copy of M bounded to a fixed size.
 
     We keep a fixed number of the original columns and rows, but replace all
-    the internals with ellipses to indicate omission.
+    the internals with ellipses to indicate omission. Only the corner blocks
+    that are kept are sliced out of M and converted to an array, so capping a
+    large tensor copies only the displayed cells. The kept cells are
+    stringified (and optionally marked) before ellipses are inserted, so that
+    formatters see them with their original type.
     """
-    return _cap_width(_cap_height(M))
+    num_rows, num_cols = M.shape
+    corners = _corners(M)
+    cells = _cells_to_string(corners)
 
+    if markers:
+        cells = _mark_cells(cells, corners, threshold)
 
-def _cap_height(M):
-    """Return a copy of M bounded to a fixed number of rows."""
-    num_rows, num_cols = M.shape
+    return _cap_width(_cap_height(cells, num_rows), num_cols)
+
+
+def _mark_cells(cells, M, threshold=None):
+    """Suffix the stringified cells of M that are NaN, infinite or outliers."""
+    values = _marker_values(M)
+
+    for marker, marked in zip(_MARKERS, _marker_masks(values, threshold)):
+        cells = np.where(marked, np.char.add(cells, marker), cells)
+
+    return cells
+
+
+def _marker_values(M):
+    """Return M as a plain numeric array, with masked cells filled with zero.
+
+    Complex values are kept complex, so that NaN or infinite imaginary parts
+    are marked too; everything else is read as float.
+    """
+    values = np.ma.asarray(M)
+    if values.dtype.kind != 'c':
+        values = values.astype(float)
 
-    if num_rows <= _MAX_HEIGHT:
+    return np.ma.filled(values, 0)
+
+
+def _marker_masks(values, threshold=None):
+    """Return masks of the NaN, infinite and, given a threshold, outlying cells."""
+    masks = [np.isnan(values), np.isinf(values)]
+    if threshold is not None:
+        masks.append(np.isfinite(values) & (np.abs(values) > threshold))
+
+    return masks
+
+
+def _scan_markers(M, threshold=None, workers=None):
+    """Return (kind, count, first location) for every kind of marked cell in M.
+
+    Outliers are only counted given a threshold. We make one pass over chunks of rows of M, so masks are only ever as large
+    as a single chunk.
+    """
+
+    def scan_chunk(bounds):
+        start, stop = bounds
+        chunk = _marker_values(M[start:stop])
+        results = []
+        for mask in _marker_masks(chunk, threshold):
+            count = int(np.count_nonzero(mask))
+            row, col = np.unravel_index(np.argmax(mask), mask.shape)
+            results.append((count, (start + int(row), int(col)) if count
+                            else None))
+        return results
+
+    kinds = _MARKER_KINDS if threshold is not None else _MARKER_KINDS[:2]
+    totals = [[0, None] for _ in kinds]
+    for results in _map_chunks(scan_chunk, _row_ranges(M), workers):
+        for total, (count, first) in zip(totals, results):
+            total[0] += count
+            total[1] = total[1] or first
+
+    return [(kind, count, first)
+            for kind, (count, first) in zip(kinds, totals)]
+
+
+def _cap_height(M, num_rows=None):
+    """Return a copy of M bounded to a fixed number of rows.
+
+    If M holds only the displayed rows of a taller matrix, num_rows gives the
+    height of that matrix.
+    """
+    num_cols = M.shape[1]
+    num_rows = M.shape[0] if num_rows is None else num_rows
+    max_height, _ = _DISPLAY_LIMITS.get()
+
+    if num_rows <= max_height:
         return M
 
     top_segment = M[:_SHRUNK_NUM_ROWS, :]
@@ -323,11 +1051,17 @@ def _cap_height(M):
              bottom_segment), axis=0)
 
 
-def _cap_width(M):
-    """Return a copy of M bounded to a fixed number of columns."""
-    num_rows, num_cols = M.shape
+def _cap_width(M, num_cols=None):
+    """Return a copy of M bounded to a fixed number of columns.
+
+    If M holds only the displayed columns of a wider matrix, num_cols gives
+    the width of that matrix.
+    """
+    num_rows = M.shape[0]
+    num_cols = M.shape[1] if num_cols is None else num_cols
+    _, max_width = _DISPLAY_LIMITS.get()
 
-    if num_cols <= _MAX_WIDTH:
+    if num_cols <= max_width:
         return M
 
     top_segment = M[:, :_SHRUNK_NUM_COLS]
@@ -340,6 +1074,737 @@ def _cap_width(M):
              bottom_segment), axis=1)
 
 
+def _displayed_slices(size, max_size, shrunk_size):
+    """Return the slices of an axis of length size that survive capping."""
+    if size <= max_size:
+        return [slice(0, size)]
+
+    return [slice(0, shrunk_size), slice(size - shrunk_size, size)]
+
+
+def _displayed_indices(size, max_size, shrunk_size):
+    """Return the indices of an axis of length size that survive capping."""
+    return _slice_indices(_displayed_slices(size, max_size, shrunk_size))
+
+
+def _slice_indices(slices):
+    """Return the indices covered by a sequence of slices, in order."""
+    return np.concatenate([np.arange(s.start, s.stop) for s in slices])
+
+
+def _corners(M):
+    """Return the cells of M that survive capping, without any ellipses.
+
+    By default each corner block is sliced out of M separately, which for
+    HDF5 datasets and similar is one read per block. Backends registered with
+    register_reader may instead read every block in one batch. The mask of a
+    masked array is kept.
+    """
+    if isinstance(M, np.ma.MaskedArray):
+        return np.ma.array(_corners(M.data), mask=_corners(np.ma.getmaskarray(M)))
+
+    num_rows, num_cols = M.shape
+    max_height, max_width = _DISPLAY_LIMITS.get()
+    row_slices = _displayed_slices(num_rows, max_height, _SHRUNK_NUM_ROWS)
+    col_slices = _displayed_slices(num_cols, max_width, _SHRUNK_NUM_COLS)
+
+    with _REGISTRY_LOCK:
+        readers = list(_READERS)
+
+    for predicate, read_blocks in readers:
+        if predicate(M):
+            return np.asarray(read_blocks(M, row_slices, col_slices))
+
+    blocks = [[np.asanyarray(M[rows, cols]) for cols in col_slices]
+              for rows in row_slices]
+
+    # Lazy nodes over masked arrays return masked blocks, which np.block would
+    # strip of their masks.
+    if any(isinstance(block, np.ma.MaskedArray) for row in blocks for block in row):
+        return np.ma.array(
+            np.block([[np.ma.getdata(block) for block in row] for row in blocks]),
+            mask=np.block([[np.ma.getmaskarray(block) for block in row]
+                           for row in blocks]))
+
+    return np.block(blocks)
+
+
+def _row_ranges(M, start=0, stop=None):
+    """Yield consecutive (start, stop) runs of the rows of M.
+
+    Each run covers at most _CHUNK_SIZE elements (but always at least one
+    row), so only a bounded slice of a memory-mapped M need be resident at
+    any time.
+    """
+    num_rows, num_cols = M.shape
+    stop = num_rows if stop is None else stop
+    step = max(1, _CHUNK_SIZE // max(1, num_cols))
+
+    for i in range(start, stop, step):
+        yield i, min(i + step, stop)
+
+
+def _row_chunks(M, start=0, stop=None):
+    """Yield consecutive runs of the rows of M in [start, stop) as floats."""
+    for i, j in _row_ranges(M, start, stop):
+        yield _dense_rows(M, i, j)
+
+
+def _dense_rows(M, start, stop, dtype=float):
+    """Return rows [start, stop) of M as a plain array of dtype.
+
+    Masked cells are filled with NaN, so that their hidden data never reaches
+    a summary.
+    """
+    rows = M[start:stop]
+
+    if isinstance(rows, np.ma.MaskedArray):
+        return np.ma.filled(rows.astype(dtype), np.nan)
+
+    return np.asarray(rows, dtype=dtype)
+
+
+def _block_statistics(M, statistic, height, width):
+    """Return a matrix of statistics over at most (height x width) blocks of M."""
+    num_rows, num_cols = M.shape
+    height, width = min(height, num_rows), min(width, num_cols)
+
+    if height == 0 or width == 0:
+        return np.full((height, width), np.nan)
+
+    row_edges = np.linspace(0, num_rows, height + 1).astype(int)
+    col_edges = np.linspace(0, num_cols, width + 1).astype(int)
+
+    return np.stack([_block_row_statistics(M, start, stop, col_edges, statistic)
+                     for start, stop in zip(row_edges[:-1], row_edges[1:])])
+
+
+def _block_row_statistics(M, start, stop, col_edges, statistic):
+    """Reduce rows [start, stop) of M to one statistic per column block."""
+    col_starts = col_edges[:-1]
+
+    if statistic == 'mean':
+        total = np.zeros(len(col_starts))
+        for chunk in _row_chunks(M, start, stop):
+            total += np.add.reduceat(chunk.sum(axis=0), col_starts)
+        return total / ((stop - start) * np.diff(col_edges))
+
+    result = np.full(len(col_starts), -np.inf)
+    for chunk in _row_chunks(M, start, stop):
+        if statistic == 'absmax':
+            chunk = np.abs(chunk)
+        result = np.maximum(result,
+                            np.maximum.reduceat(chunk.max(axis=0), col_starts))
+    return result
+
+
+def _shade(M):
+    """Return a matrix of shade characters, one per cell of the numeric M."""
+    finite = np.isfinite(M)
+    shaded = np.full(M.shape, _NON_FINITE_SHADE)
+
+    if not finite.any():
+        return shaded
+
+    low, high = M[finite].min(), M[finite].max()
+    scale = (M[finite] - low) / (high - low) if high > low else np.zeros(finite.sum())
+    indices = np.rint(scale * (len(_SHADES) - 1)).astype(int)
+    shaded[finite] = np.array(list(_SHADES))[indices]
+
+    return shaded
+
+
+def _partial_statistics(x, axis=None):
+    """Return NaN-ignoring partial statistics of x, reduced along axis.
+
+    Partials from disjoint parts of a matrix can be merged with
+    _combine_statistics.
+    """
+    nans = np.isnan(x)
+    filled = np.where(nans, 0, x)
+    return (np.fmin.reduce(x, axis=axis, initial=np.nan),
+            np.fmax.reduce(x, axis=axis, initial=np.nan),
+            filled.sum(axis=axis),
+            np.square(filled).sum(axis=axis),
+            np.logical_not(nans).sum(axis=axis),
+            nans.sum(axis=axis))
+
+
+def _combine_statistics(a, b):
+    """Merge two partials returned by _partial_statistics."""
+    return (np.fmin(a[0], b[0]), np.fmax(a[1], b[1])) + tuple(
+        x + y for x, y in zip(a[2:], b[2:]))
+
+
+def _finalize_statistics(partial, stats):
+    """Return the named statistics from a partial."""
+    minimum, maximum, total, squares, count, nans = partial
+    with np.errstate(invalid='ignore', divide='ignore'):
+        values = {
+            'min': minimum,
+            'max': maximum,
+            'mean': total / count,
+            'norm': np.sqrt(squares),
+            'nans': nans,
+        }
+    return [values[stat] for stat in stats]
+
+
+def _margin_statistics(M, stats, workers=None):
+    """Return statistics of the displayed rows, displayed columns and all of M.
+
+    We make one pass over chunks of rows of M. For every chunk we reduce the
+    displayed columns, any displayed rows falling in the chunk, and the chunk
+    as a whole; the per-chunk partials are then merged.
+    """
+    unknown = set(stats) - set(_MARGIN_STATISTICS)
+    if unknown:
+        raise ValueError("Margins must be drawn from {}".format(
+            ', '.join(_MARGIN_STATISTICS)))
+
+    num_rows, num_cols = M.shape
+    max_height, max_width = _DISPLAY_LIMITS.get()
+    rows = _displayed_indices(num_rows, max_height, _SHRUNK_NUM_ROWS)
+    cols = _displayed_indices(num_cols, max_width, _SHRUNK_NUM_COLS)
+
+    def reduce_chunk(bounds):
+        start, stop = bounds
+        chunk = _dense_rows(M, start, stop)
+        local_rows = rows[(rows >= start) & (rows < stop)] - start
+        return (_partial_statistics(chunk[local_rows], axis=1),
+                _partial_statistics(chunk[:, cols], axis=0),
+                _partial_statistics(chunk))
+
+    # Seed the merge with an empty chunk, so that matrices without any rows
+    # still produce (NaN) statistics.
+    row_partials, col_partials, global_partials = zip(
+        reduce_chunk((0, 0)),
+        *_map_chunks(reduce_chunk, _row_ranges(M), workers))
+
+    row_partial = tuple(np.concatenate(x) for x in zip(*row_partials))
+    col_partial = functools.reduce(_combine_statistics, col_partials)
+    global_partial = functools.reduce(_combine_statistics, global_partials)
+
+    return (_finalize_statistics(row_partial, stats),
+            _finalize_statistics(col_partial, stats),
+            _finalize_statistics(global_partial, stats))
+
+
+def _map_chunks(function, chunks, workers=None):
+    """Apply function to every chunk, optionally in a pool of worker threads.
+
+    NumPy releases the GIL inside most reductions, so threads make progress
+    in parallel on large chunks. Every chunk runs in a copy of the caller's
+    context, so workers see the caller's printoptions.
+    """
+    if not workers:
+        return list(map(function, chunks))
+
+    context = contextvars.copy_context()
+
+    def run(chunk):
+        return context.copy().run(function, chunk)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, chunks))
+
+
+def _comparison_dtype(A, B):
+    """Return the dtype in which to compare arrays A and B.
+
+    Complex values are compared as complex, so that imaginary parts count, and
+    everything else as float.
+    """
+    return complex if 'c' in (A.dtype.kind, B.dtype.kind) else float
+
+
+def _compare(A, B, rtol, atol, dtype=float, workers=None):
+    """Return the number of cells where A and B differ, and the largest error."""
+
+    def compare_chunk(bounds):
+        start, stop = bounds
+        a = _dense_rows(A, start, stop, dtype)
+        b = _dense_rows(B, start, stop, dtype)
+        mismatches = np.count_nonzero(
+            ~np.isclose(a, b, rtol=rtol, atol=atol, equal_nan=True))
+        return mismatches, np.fmax.reduce(np.abs(a - b), axis=None, initial=np.nan)
+
+    mismatches, errors = zip(
+        (0, np.nan), *_map_chunks(compare_chunk, _row_ranges(A), workers))
+
+    return sum(mismatches), np.fmax.reduce(errors, initial=np.nan)
+
+
+def _format_statistic(value, exact=False):
+    """Return a compact string representation of a statistic.
+
+    Exact statistics, such as counts, are written out in full when finite.
+    """
+    if exact and np.isfinite(value):
+        return str(int(value))
+
+    return '{:.4g}'.format(value)
+
+
+def _exact_statistics(M, stats):
+    """Return whether each of the named statistics of M is a whole number."""
+    integral = _corners(M).dtype.kind in 'biu'
+    return [stat == 'nans' or (integral and stat in ('min', 'max'))
+            for stat in stats]
+
+
+def _append_margins(cells, shape, stats, row_stats, col_stats, exact=None):
+    """Return a stringified, capped matrix extended with margin statistics.
+
+    Row statistics are appended as columns to the right of cells, and column
+    statistics as rows beneath it. Each statistic is labelled beneath its
+    column, and again beside its row in the bottom-right corner. exact flags
+    the statistics to be written out in full.
+    """
+    num_rows, num_cols = shape
+    format_all = np.vectorize(_format_statistic, otypes=[str])
+    num_stats = len(stats)
+    num_displayed_rows = cells.shape[0]
+    exact = exact or [False] * num_stats
+
+    row_margin = _cap_height(
+        np.stack([format_all(np.reshape(values, -1), is_exact)
+                  for values, is_exact in zip(row_stats, exact)], axis=1),
+        num_rows)
+    col_margin = _cap_width(
+        np.stack([format_all(np.reshape(values, -1), is_exact)
+                  for values, is_exact in zip(col_stats, exact)], axis=0),
+        num_cols)
+    labels = np.where(np.eye(num_stats, dtype=bool), np.array(stats), _PAD)
+
+    # The rule under each column of cells spans the width of that column.
+    rule = np.array([[_MARGIN_ROW_SEPARATOR * width for width in
+                      _column_widths(np.concatenate((cells, col_margin)))]])
+
+    top = np.concatenate(
+        (cells,
+         _character_column(_MARGIN_COLUMN_SEPARATOR, num_displayed_rows),
+         row_margin), axis=1)
+    separator = np.concatenate(
+        (rule,
+         _character_cell(_MARGIN_CROSS),
+         np.array([stats])), axis=1)
+    bottom = np.concatenate(
+        (col_margin,
+         _character_column(_MARGIN_COLUMN_SEPARATOR, num_stats),
+         labels), axis=1)
+
+    return np.concatenate((top, separator, bottom), axis=0)
+
+
+def _is_instance_from(M, package):
+    """Return whether M's type is defined in package, without importing it."""
+    return type(M).__module__.split('.')[0] == package
+
+
+def _read_dask_blocks(M, row_slices, col_slices):
+    """Compute every displayed block of a Dask array in one graph."""
+    import dask
+
+    blocks = dask.compute(*[M[rows, cols] for rows in row_slices
+                            for cols in col_slices])
+    return np.block([list(blocks[i:i + len(col_slices)])
+                     for i in range(0, len(blocks), len(col_slices))])
+
+
+def _read_zarr_blocks(M, row_slices, col_slices):
+    """Read every displayed cell of a Zarr array in one orthogonal selection."""
+    return M.get_orthogonal_selection((_slice_indices(row_slices),
+                                       _slice_indices(col_slices)))
+
+
 def _render(M):
     """Return a string representation of the matrix, M."""
     return '\n'.join((''.join(row) for row in M))
+
+
+def _render_text(items):
+    """Serialize a sequence of layouts as plain text."""
+    return _render(_side_by_side([_text_item(item) for item in items]))
+
+
+def _text_item(item):
+    """Return a matrix of characters for a single layout."""
+    if not item.framed:
+        operator = _normalize_cell_width(item.cells)
+        return np.concatenate(
+            (_character_row(_PAD, operator.shape[1], height=len(item.headers)),
+             operator), axis=0)
+
+    N = _border(
+            _pad(
+            _space_columns(
+            *_normalize_all_cells(item.cells, item.widths))))
+
+    for header in reversed(item.headers):
+        N = _prepend_string_row(N, header)
+
+    return N
+
+
+def _render_ansi(items):
+    """Serialize a sequence of layouts as text, colouring matching dimensions."""
+    sizes = [size for item in items if item.framed for size in item.shape]
+    colours = {size: _PALETTE[i % len(_PALETTE)]
+               for i, size in enumerate(dict.fromkeys(sizes))}
+
+    def colour(header, shape):
+        if header != '({}x{})'.format(*shape):
+            return header
+        return '({}{}{}x{}{}{})'.format(colours[shape[0]], shape[0], _RESET,
+                                        colours[shape[1]], shape[1], _RESET)
+
+    return _render_text([
+        item._replace(headers=[colour(header, item.shape) for header in item.headers])
+        if item.framed else item
+        for item in items])
+
+
+def _render_html(items):
+    """Serialize a sequence of layouts as an HTML fragment."""
+    return ('<div class="prettymatrix" style="display: flex; '
+            'align-items: center; gap: 0.5em">{}</div>').format(
+                ''.join(_html_item(item) for item in items))
+
+
+def _html_item(item):
+    """Serialize a single layout as HTML."""
+    if not item.framed:
+        return '<div>{}</div>'.format(html.escape(item.cells[0, 0]))
+
+    headers = ''.join('<div>{}</div>'.format(html.escape(header))
+                      for header in item.headers if header.strip())
+    rows = ''.join('<tr>{}</tr>'.format(''.join(
+        '<td style="padding: 0 0.25em">{}</td>'.format(html.escape(cell))
+        for cell in row)) for row in item.cells)
+
+    return ('<div>{}<table style="border-collapse: collapse; '
+            'border-left: 1px solid; border-right: 1px solid">{}</table>'
+            '</div>').format(headers, rows)
+
+
+def _render_latex(items):
+    """Serialize a sequence of layouts as LaTeX (in math mode)."""
+    return ' '.join(_latex_item(item) for item in items)
+
+
+def _latex_item(item):
+    """Serialize a single layout as LaTeX."""
+    if not item.framed:
+        operator = item.cells[0, 0]
+        if operator in _LATEX_OPERATORS:
+            return _LATEX_OPERATORS[operator]
+        return functools.reduce(lambda text, superscript: text.replace(*superscript),
+                                _LATEX_SUPERSCRIPTS.items(), _latex_math(operator))
+
+    # Each band of elided rows or columns is drawn as a single row or column.
+    elided = item.cells == _ELLIPSIS
+    row_band, col_band = elided.all(axis=1), elided.all(axis=0)
+    keep_rows = ~(row_band & np.concatenate(([False], row_band[:-1])))
+    keep_cols = ~(col_band & np.concatenate(([False], col_band[:-1])))
+    elided = elided[np.ix_(keep_rows, keep_cols)]
+    elided_rows = elided.all(axis=1, keepdims=True) & elided
+    elided_cols = elided.all(axis=0, keepdims=True) & elided
+
+    cells = np.vectorize(_latex_math, otypes=[object])(
+        item.cells[np.ix_(keep_rows, keep_cols)])
+    cells[elided] = r'\cdots'
+    cells[elided_rows] = r'\vdots'
+    cells[elided_rows & elided_cols] = r'\ddots'
+
+    matrix = r'\begin{{bmatrix}} {} \end{{bmatrix}}'.format(
+        r' \\ '.join(' & '.join(row) for row in cells))
+
+    headers = [r'\text{{{}}}'.format(_latex_escape(header))
+               for header in item.headers if header.strip()]
+    if not headers:
+        return matrix
+
+    return r'\overset{{\substack{{{}}}}}{{{}}}'.format(r' \\ '.join(headers),
+                                                   matrix)
+
+
+def _latex_escape(text):
+    """Escape characters with special meaning to LaTeX, for text mode."""
+    return ''.join(_LATEX_SPECIAL_CHARACTERS.get(c, c) for c in text)
+
+
+def _latex_math(text):
+    """Escape text for math mode, switching to text mode where needed."""
+    if any(c in _LATEX_TEXT_ESCAPES for c in text):
+        return r'\text{{{}}}'.format(_latex_escape(text))
+
+    return _latex_escape(text)
+
+
+def _render_markdown(items):
+    """Serialize a sequence of layouts as Markdown."""
+    return '\n\n'.join(_markdown_item(item) for item in items)
+
+
+def _markdown_item(item):
+    """Serialize a single layout as Markdown, framing matrices as tables."""
+    if not item.framed:
+        return item.cells[0, 0]
+
+    lines = [header for header in item.headers if header.strip()]
+    if lines:
+        lines.append('')
+
+    cells = np.char.replace(item.cells, '|', '\\|')
+    widths = np.maximum(_column_widths(cells), 3)
+
+    def row(values):
+        return '| {} |'.format(' | '.join(
+            value.ljust(width) for value, width in zip(values, widths)))
+
+    if cells.shape[1]:
+        lines.append(row([''] * cells.shape[1]))
+        lines.append(row(['-' * width for width in widths]))
+        lines.extend(row(cell_row) for cell_row in cells)
+
+    return '\n'.join(lines)
+
+
+def _load(path):
+    """Return (name, array) pairs for every array in a file.
+
+    Arrays are memory-mapped wherever possible, so that only the pages holding
+    displayed cells are read. Compressed .npz members can't be mapped, and are
+    loaded in full. Delimited text files are read with read_text.
+    """
+    name, extension = os.path.basename(path), os.path.splitext(path)[1].lower()
+
+    if extension in _TEXT_DELIMITERS:
+        return [(name, read_text(path, _TEXT_DELIMITERS[extension]))]
+
+    with open(path, 'rb') as f:
+        is_npz = f.read(len(_ZIP_MAGIC)) == _ZIP_MAGIC
+
+    if not is_npz:
+        return [(name, np.load(path, mmap_mode='r'))]
+
+    with zipfile.ZipFile(path) as archive:
+        members = [info for info in archive.infolist()
+                   if info.filename.endswith('.npy')]
+
+    with np.load(path, allow_pickle=False) as npz:
+        return [(info.filename[:-len('.npy')],
+                 _map_npz_member(path, info, npz)
+                 if info.compress_type == zipfile.ZIP_STORED
+                 else npz[info.filename[:-len('.npy')]])
+                for info in members]
+
+
+def _map_npz_member(path, info, npz):
+    """Memory-map an uncompressed member of an .npz archive.
+
+    Members holding Python objects are pickled, and mapping them would read
+    the pickle as object pointers, so they (and members in formats we can't
+    parse here) are left to npz, which refuses to unpickle.
+    """
+    key = info.filename[:-len('.npy')]
+
+    with open(path, 'rb') as f:
+        # The local file header is 30 bytes, followed by the file name and an
+        # extra field whose lengths are stored at offsets 26 and 28.
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = np.frombuffer(f.read(4), dtype='<u2')
+        f.seek(info.header_offset + 30 + int(name_length) + int(extra_length))
+
+        version = np.lib.format.read_magic(f)
+        if version not in ((1, 0), (2, 0)):
+            return npz[key]
+
+        read_header = (np.lib.format.read_array_header_1_0 if version == (1, 0)
+                       else np.lib.format.read_array_header_2_0)
+        shape, fortran_order, dtype = read_header(f)
+        offset = f.tell()
+
+    if dtype.hasobject:
+        return npz[key]
+
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def _read_head(f, n):
+    """Return up to the first n lines of the binary file f."""
+    return [line.rstrip(b'\r\n') for line in itertools.islice(f, n)]
+
+
+def _read_tail(f, n):
+    """Return the last n lines of the binary file f, by seeking from its end."""
+    position = f.seek(0, os.SEEK_END)
+    data = b''
+
+    while position > 0 and data.rstrip(b'\r\n').count(b'\n') < n:
+        size = min(_TEXT_BLOCK_SIZE, position)
+        position -= size
+        f.seek(position)
+        data = f.read(size) + data
+
+    return [line.rstrip(b'\r') for line in data.rstrip(b'\r\n').split(b'\n')[-n:]]
+
+
+def _only_line_endings_remain(f):
+    """Return whether the rest of the binary file f holds only line endings."""
+    for block in iter(lambda: f.read(_TEXT_BLOCK_SIZE), b''):
+        if block.strip(b'\r\n'):
+            return False
+
+    return True
+
+
+def _count_lines(f):
+    """Return the number of lines in the binary file f, bar trailing blanks."""
+    f.seek(0)
+    count, trailing, empty = 0, 0, True
+
+    for block in iter(lambda: f.read(_TEXT_BLOCK_SIZE), b''):
+        count += block.count(b'\n')
+        content = block.rstrip(b'\r\n')
+        if content:
+            trailing, empty = block[len(content):].count(b'\n'), False
+        else:
+            trailing += block.count(b'\n')
+
+    return 0 if empty else count - trailing + 1
+
+
+def _split_displayed_fields(line, delimiter, num_cols):
+    """Return the fields of a line of text that survive capping."""
+    _, max_width = _DISPLAY_LIMITS.get()
+
+    if num_cols <= max_width:
+        fields = line.split(delimiter)
+        complete = len(fields) == num_cols
+    else:
+        first = line.split(delimiter, _SHRUNK_NUM_COLS)
+        last = line.rsplit(delimiter, _SHRUNK_NUM_COLS)
+        fields = first[:_SHRUNK_NUM_COLS] + last[1:]
+        complete = len(first) == len(last) == _SHRUNK_NUM_COLS + 1
+
+    if not complete:
+        raise ValueError("Expected {} fields in line: {}".format(num_cols, line))
+
+    return [field.strip() for field in fields]
+
+
+class _TextMatrix(object):
+    """The displayed cells of a text matrix, sliceable as if it were whole."""
+
+    def __init__(self, cells, shape):
+        self.shape = shape
+        self._cells = cells
+        max_height, max_width = _DISPLAY_LIMITS.get()
+        self._rows = _displayed_indices(shape[0], max_height, _SHRUNK_NUM_ROWS)
+        self._cols = _displayed_indices(shape[1], max_width, _SHRUNK_NUM_COLS)
+
+    def __getitem__(self, key):
+        if not (isinstance(key, tuple) and len(key) == 2 and
+                all(isinstance(k, slice) for k in key)):
+            raise TypeError("Text matrices hold only their displayed cells, so "
+                            "can only be sliced as [rows, cols], and do not "
+                            "support margins, markers, heatmaps or diffs")
+
+        rows, cols = key
+        return self._cells[np.ix_(_positions(self._rows, rows, self.shape[0]),
+                                  _positions(self._cols, cols, self.shape[1]))]
+
+
+def _positions(indices, key, size):
+    """Return where the indices selected by slice key appear in indices."""
+    wanted = np.arange(*key.indices(size))
+    positions = np.searchsorted(indices, wanted)
+
+    if (positions >= len(indices)).any() or (indices[positions] != wanted).any():
+        raise IndexError("Only the displayed cells of a text matrix can be read")
+
+    return positions
+
+
+def main(argv=None):
+    """Print every matrix in the given .npy, .npz, .csv, .tsv and .txt files.
+
+    Arrays with more than two dimensions are printed with all but their last
+    axis stacked into rows, or, where that would copy them, as one matrix per
+    index of their leading axes. Empty arrays are skipped.
+
+    Load and render timings are reported on stderr.
+    """
+    parser = argparse.ArgumentParser(
+        prog='python -m prettymatrix',
+        description='Pretty print the matrices in .npy, .npz and text files.')
+    parser.add_argument('paths', nargs='+', metavar='path',
+                        help='a .npy, .npz, .csv, .tsv or whitespace-delimited .txt file')
+    args = parser.parse_args(argv)
+
+    for path in args.paths:
+        start = time.perf_counter()
+        arrays = _load(path)
+        loaded = time.perf_counter()
+
+        for array_name, array in arrays:
+            for name, M in _matrices(array_name, array):
+                if 0 in M.shape:
+                    print('{}: empty, skipped'.format(name), file=sys.stderr)
+                    continue
+
+                rendered = time.perf_counter()
+                print(matrix_to_string(M, name=name, include_dimensions=True))
+                print('{}: loaded in {:.1f}ms, rendered in {:.1f}ms'.format(
+                    name, 1000 * (loaded - start),
+                    1000 * (time.perf_counter() - rendered)), file=sys.stderr)
+
+    return 0
+
+
+def _matrices(name, M):
+    """Yield (name, matrix) pairs that display an array of any dimension.
+
+    Leading axes are stacked into rows only if that needs no copy, so a
+    memory-mapped array is never read in full; otherwise they are split into
+    one matrix per index. The original shape or index is added to the name.
+    """
+    if len(M.shape) < 2:
+        yield name, np.atleast_2d(M)
+    elif len(M.shape) == 2:
+        yield name, M
+    elif M.flags.c_contiguous:
+        yield ('{} ({})'.format(name, 'x'.join(map(str, M.shape))),
+               M.reshape(-1, M.shape[-1]))
+    else:
+        for index in np.ndindex(*M.shape[:-2]):
+            yield '{}[{}]'.format(name, ', '.join(map(str, index))), M[index]
+
+
+_ARRAY_FORMATTERS = {
+    'c': _format_complex,
+    'O': _format_objects,
+}
+
+
+_BACKENDS = {
+    'text': _render_text,
+    'ansi': _render_ansi,
+    'html': _render_html,
+    'latex': _render_latex,
+    'markdown': _render_markdown,
+}
+
+
+register_formatter(complex, lambda x: _format_complex(np.array(x)).item())
+
+
+register_reader(lambda M: _is_instance_from(M, 'dask'), _read_dask_blocks)
+register_reader(lambda M: _is_instance_from(M, 'zarr'), _read_zarr_blocks)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
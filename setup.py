@@ -10,5 +10,6 @@ setup(
     url='https://github.com/samueljamesbell/prettymatrix',
     description='Pretty printer for matrices and column vectors.',
     keywords='matrix matrices vector formatting string numpy',
-    install_requires=['numpy'],
+    install_requires=['numpy>=1.15'],
+    python_requires='>=3.7',
 )
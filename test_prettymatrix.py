@@ -1,4 +1,17 @@
+import contextlib
+import decimal
+import fractions
+import io
+import os
+import re
+import tempfile
+import threading
+import tracemalloc
 import unittest
+import warnings
+import zipfile
+from concurrent import futures
+from unittest import mock
 
 import numpy as np
 
@@ -648,5 +661,1293 @@ class ExpressionToStringTest(unittest.TestCase):
                                               names=['M', 'N'])
 
 
+class HeatmapToStringTest(unittest.TestCase):
+
+    def test_empty_matrix(self):
+        expected = (
+            "┌  ┐\n"
+            "└  ┘"
+        )
+        actual = prettymatrix.heatmap_to_string(np.zeros((0, 0)))
+        self.assertEqual(expected, actual)
+
+    def test_2_x_2_matrix_is_shaded_by_value(self):
+        expected = (
+            "┌    ┐\n"
+            "│  ░ │\n"
+            "│ ▓█ │\n"
+            "└    ┘"
+        )
+        actual = prettymatrix.heatmap_to_string(np.array([[0, 1], [3, 4]]))
+        self.assertEqual(expected, actual)
+
+    def test_non_finite_blocks_are_marked(self):
+        expected = (
+            "┌    ┐\n"
+            "│  █ │\n"
+            "│ ?? │\n"
+            "└    ┘"
+        )
+        actual = prettymatrix.heatmap_to_string(np.array([[0, 1], [np.nan, np.inf]]))
+        self.assertEqual(expected, actual)
+
+    def test_large_matrix_is_reduced_to_block_means(self):
+        expected = (
+            "┌    ┐\n"
+            "│  █ │\n"
+            "│  █ │\n"
+            "└    ┘"
+        )
+        M = np.zeros((100, 40))
+        M[:, 20:] = 1
+        actual = prettymatrix.heatmap_to_string(M, height=2, width=2)
+        self.assertEqual(expected, actual)
+
+    def test_max_and_absmax_statistics(self):
+        M = np.zeros((4, 4))
+        M[0, 0] = -8
+        M[3, 3] = 2
+
+        self.assertEqual(
+            "┌    ┐\n"
+            "│    │\n"
+            "│  █ │\n"
+            "└    ┘",
+            prettymatrix.heatmap_to_string(M, statistic='max', height=2, width=2))
+        self.assertEqual(
+            "┌    ┐\n"
+            "│ █  │\n"
+            "│  ░ │\n"
+            "└    ┘",
+            prettymatrix.heatmap_to_string(M, statistic='absmax', height=2, width=2))
+
+    def test_memmapped_matrix_is_streamed_in_chunks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            M = np.memmap(os.path.join(directory, 'M.dat'), dtype=float,
+                          mode='w+', shape=(64, 64))
+            M[32:, :] = 1
+
+            with mock.patch.object(prettymatrix, '_CHUNK_SIZE', 64 * 4):
+                actual = prettymatrix.heatmap_to_string(M, height=2, width=1)
+
+            del M
+
+        expected = (
+            "┌   ┐\n"
+            "│   │\n"
+            "│ █ │\n"
+            "└   ┘"
+        )
+        self.assertEqual(expected, actual)
+
+    def test_dimensions_and_name(self):
+        expected = (
+            "M     \n"
+            "(20x1)\n"
+            "┌   ┐ \n"
+            "│   │ \n"
+            "│ █ │ \n"
+            "└   ┘ "
+        )
+        actual = prettymatrix.heatmap_to_string(np.arange(20).reshape(20, 1),
+                                                name='M',
+                                                include_dimensions=True,
+                                                height=2)
+        self.assertEqual(expected, actual)
+
+    def test_masked_cells_are_not_shaded(self):
+        expected = (
+            "┌    ┐\n"
+            "│  ? │\n"
+            "│ ▓█ │\n"
+            "└    ┘"
+        )
+        M = np.ma.masked_array(np.arange(4.).reshape(2, 2),
+                               mask=[[0, 1], [0, 0]])
+        actual = prettymatrix.heatmap_to_string(M)
+        self.assertEqual(expected, actual)
+
+    def test_non_positive_size(self):
+        for height, width in ((0, 10), (10, 0), (-1, 10)):
+            with self.assertRaises(ValueError):
+                prettymatrix.heatmap_to_string(np.zeros((4, 4)), height=height,
+                                               width=width)
+
+    def test_unknown_statistic(self):
+        with self.assertRaises(ValueError):
+            prettymatrix.heatmap_to_string(np.zeros((1, 1)), statistic='median')
+
+
+class MarginsTest(unittest.TestCase):
+
+    def test_margins_of_small_matrix(self):
+        expected = (
+            "min=0, max=8, nans=1          \n"
+            "┌                            ┐\n"
+            "│ 0.0 1.0 2.0 │ 0   2   0    │\n"
+            "│ 3.0 nan 5.0 │ 3   5   1    │\n"
+            "│ 6.0 7.0 8.0 │ 6   8   0    │\n"
+            "│ ─── ─── ─── ┼ min max nans │\n"
+            "│ 0   1   2   │ min          │\n"
+            "│ 6   7   8   │     max      │\n"
+            "│ 0   1   0   │         nans │\n"
+            "└                            ┘"
+        )
+        M = np.arange(9.).reshape(3, 3)
+        M[1, 1] = np.nan
+        actual = prettymatrix.matrix_to_string(M, margins=('min', 'max', 'nans'))
+        self.assertEqual(expected, actual)
+
+    def test_margins_of_large_matrix(self):
+        expected = (
+            "mean=61                                 \n"
+            "┌                                      ┐\n"
+            "│ 1   2   3   … … … 9   10  11  │ 6    │\n"
+            "│ 12  13  14  … … … 20  21  22  │ 17   │\n"
+            "│ 23  24  25  … … … 31  32  33  │ 28   │\n"
+            "│ …   …   …   … … … …   …   …   │ …    │\n"
+            "│ …   …   …   … … … …   …   …   │ …    │\n"
+            "│ …   …   …   … … … …   …   …   │ …    │\n"
+            "│ 89  90  91  … … … 97  98  99  │ 94   │\n"
+            "│ 100 101 102 … … … 108 109 110 │ 105  │\n"
+            "│ 111 112 113 … … … 119 120 121 │ 116  │\n"
+            "│ ─── ─── ─── ─ ─ ─ ─── ─── ─── ┼ mean │\n"
+            "│ 56  57  58  … … … 64  65  66  │ mean │\n"
+            "└                                      ┘"
+        )
+        actual = prettymatrix.matrix_to_string(np.arange(1, 122).reshape(11, 11),
+                                               margins=['mean'])
+        self.assertEqual(expected, actual)
+
+    def test_threaded_margins_of_memmap_match_sequential(self):
+        with tempfile.TemporaryDirectory() as directory:
+            M = np.memmap(os.path.join(directory, 'M.dat'), dtype=float,
+                          mode='w+', shape=(200, 50))
+            M[:] = np.random.RandomState(0).normal(size=(200, 50))
+            M[100, 3] = np.nan
+
+            stats = ('min', 'max', 'mean', 'norm', 'nans')
+            with mock.patch.object(prettymatrix, '_CHUNK_SIZE', 50 * 7):
+                sequential = prettymatrix.matrix_to_string(M, margins=stats)
+                threaded = prettymatrix.matrix_to_string(M, margins=stats,
+                                                         workers=4)
+
+            expected = np.nanmean(M)
+            del M
+
+        self.assertEqual(sequential, threaded)
+        self.assertIn('mean={:.4g}'.format(expected), threaded)
+        self.assertIn('nans=1', threaded)
+
+    def test_counts_and_integer_extrema_are_exact(self):
+        M = np.arange(200000).reshape(2, 100000)
+        M[M % 2 == 1] = 0
+        N = np.full((2, 100000), np.nan)
+
+        self.assertEqual(
+            "min=0, max=199998",
+            prettymatrix.matrix_to_string(M, margins=('min', 'max')).split('\n')[0].rstrip())
+        self.assertEqual(
+            "nans=200000",
+            prettymatrix.matrix_to_string(N, margins=('nans',)).split('\n')[0].rstrip())
+        self.assertIn("│ 100000 ", prettymatrix.matrix_to_string(N, margins=('nans',)))
+
+    def test_masked_cells_are_treated_as_nan(self):
+        expected = (
+            "max=1, nans=1         \n"
+            "┌                    ┐\n"
+            "│ 1.0 --  │ 1   1    │\n"
+            "│ ─── ─── ┼ max nans │\n"
+            "│ 1   nan │ max      │\n"
+            "│ 0   1   │     nans │\n"
+            "└                    ┘"
+        )
+        M = np.ma.masked_array([[1., 1e9]], mask=[[0, 1]])
+        actual = prettymatrix.matrix_to_string(M, margins=('max', 'nans'))
+        self.assertEqual(expected, actual)
+
+    def test_unknown_margin(self):
+        with self.assertRaises(ValueError):
+            prettymatrix.matrix_to_string(np.zeros((1, 1)), margins=['median'])
+
+
+class MarkersTest(unittest.TestCase):
+
+    def test_markers_of_small_matrix(self):
+        expected = (
+            "nans=1 at (0, 1), infs=1 at (1, 0), outliers=1 at (1, 1)\n"
+            "┌            ┐                                          \n"
+            "│ 1.0  nan?  │                                          \n"
+            "│ inf! 50.0^ │                                          \n"
+            "└            ┘                                          "
+        )
+        M = np.array([[1., np.nan], [np.inf, 50.]])
+        actual = prettymatrix.matrix_to_string(M, markers=True, threshold=10)
+        self.assertEqual(expected, actual)
+
+    def test_markers_without_threshold(self):
+        expected = (
+            "nans=0, infs=0\n"
+            "┌         ┐   \n"
+            "│ 1.0 1.0 │   \n"
+            "│ 1.0 1.0 │   \n"
+            "└         ┘   "
+        )
+        actual = prettymatrix.matrix_to_string(np.ones((2, 2)), markers=True)
+        self.assertEqual(expected, actual)
+
+    def test_markers_of_complex_matrix(self):
+        M = np.array([[1 + 1j, complex(1, np.nan)], [complex(0, np.inf), 5j]])
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            actual = prettymatrix.matrix_to_string(M, markers=True, threshold=2)
+
+        self.assertEqual(
+            "nans=1 at (0, 1), infs=1 at (1, 0), outliers=1 at (1, 1)",
+            actual.split('\n')[0].rstrip())
+
+    def test_markers_count_elided_cells_of_memmap(self):
+        with tempfile.TemporaryDirectory() as directory:
+            M = np.memmap(os.path.join(directory, 'M.dat'), dtype=float,
+                          mode='w+', shape=(200, 50))
+            M[100, 20] = np.nan
+            M[150, 3] = np.nan
+            M[120, 40] = -np.inf
+            M[0, 0] = 5
+
+            with mock.patch.object(prettymatrix, '_CHUNK_SIZE', 50 * 7):
+                sequential = prettymatrix.matrix_to_string(M, markers=True,
+                                                           threshold=1)
+                threaded = prettymatrix.matrix_to_string(M, markers=True,
+                                                         threshold=1,
+                                                         workers=4)
+            del M
+
+        self.assertEqual(sequential, threaded)
+        self.assertEqual(
+            'nans=2 at (100, 20), infs=1 at (120, 40), outliers=1 at (0, 0)',
+            threaded.split('\n')[0].rstrip())
+        self.assertIn('5.0^', threaded)
+        self.assertNotIn('?', threaded.split('\n', 1)[1])
+
+
+class DiffToStringTest(unittest.TestCase):
+
+    def test_identical_matrices(self):
+        expected = (
+            "mismatches=0/2, max_abs_error=0\n"
+            "┌   ┐ ┌   ┐                    \n"
+            "│ 1 │ │ 1 │                    \n"
+            "│ 2 │ │ 2 │                    \n"
+            "└   ┘ └   ┘                    "
+        )
+        M = np.array([[1], [2]])
+        actual = prettymatrix.diff_to_string(M, M)
+        self.assertEqual(expected, actual)
+
+    def test_differing_cells_are_marked_with_shared_widths(self):
+        expected = (
+            "mismatches=1/4, max_abs_error=9\n"
+            "A         B                    \n"
+            "┌       ┐ ┌       ┐            \n"
+            "│ 1 2*  │ │ 1 11* │            \n"
+            "│ 3 4   │ │ 3 4   │            \n"
+            "└       ┘ └       ┘            "
+        )
+        A = np.array([[1, 2], [3, 4]])
+        B = np.array([[1, 11], [3, 4]])
+        actual = prettymatrix.diff_to_string(A, B, names=['A', 'B'])
+        self.assertEqual(expected, actual)
+
+    def test_tolerances(self):
+        A = np.array([[1.0, 100.0]])
+        B = np.array([[1.05, 101.0]])
+
+        def header(actual):
+            return actual.split('\n')[0].rstrip()
+
+        self.assertEqual("mismatches=2/2, max_abs_error=1",
+                         header(prettymatrix.diff_to_string(A, B)))
+        self.assertEqual("mismatches=1/2, max_abs_error=1",
+                         header(prettymatrix.diff_to_string(A, B, atol=0.1, rtol=0)))
+        self.assertEqual("mismatches=0/2, max_abs_error=1",
+                         header(prettymatrix.diff_to_string(A, B, rtol=0.1)))
+
+    def test_complex_matrices_compare_imaginary_parts(self):
+        expected = (
+            "mismatches=1/2, max_abs_error=1              \n"
+            "┌                    ┐ ┌                    ┐\n"
+            "│ 0.0+1.0j* 1.0+0.0j │ │ 0.0+2.0j* 1.0+0.0j │\n"
+            "└                    ┘ └                    ┘"
+        )
+        actual = prettymatrix.diff_to_string(np.array([[1j, 1]]),
+                                             np.array([[2j, 1]]))
+        self.assertEqual(expected, actual)
+
+    def test_differences_under_masks_are_ignored(self):
+        expected = (
+            "mismatches=0/2, max_abs_error=0\n"
+            "┌        ┐ ┌        ┐          \n"
+            "│ 1.0 -- │ │ 1.0 -- │          \n"
+            "└        ┘ └        ┘          "
+        )
+        A = np.ma.masked_array([[1., 1e9]], mask=[[0, 1]])
+        B = np.ma.masked_array([[1., 0.]], mask=[[0, 1]])
+        actual = prettymatrix.diff_to_string(A, B)
+        self.assertEqual(expected, actual)
+
+    def test_mismatches_in_elided_cells_are_counted(self):
+        with tempfile.TemporaryDirectory() as directory:
+            A = np.memmap(os.path.join(directory, 'A.dat'), dtype=float,
+                          mode='w+', shape=(100, 30))
+            B = np.memmap(os.path.join(directory, 'B.dat'), dtype=float,
+                          mode='w+', shape=(100, 30))
+            B[50, 15] = 2.5
+            B[60, 0] = np.nan
+
+            with mock.patch.object(prettymatrix, '_CHUNK_SIZE', 30 * 9):
+                actual = prettymatrix.diff_to_string(A, B, workers=2)
+
+            del A, B
+
+        self.assertEqual("mismatches=2/3000, max_abs_error=2.5",
+                         actual.split('\n')[0].rstrip())
+        self.assertNotIn('*', actual)
+
+    def test_different_shapes(self):
+        with self.assertRaises(ValueError):
+            prettymatrix.diff_to_string(np.zeros((1, 2)), np.zeros((2, 1)))
+
+    def test_too_many_names(self):
+        with self.assertRaises(ValueError):
+            prettymatrix.diff_to_string(np.zeros((1, 1)), np.zeros((1, 1)),
+                                        names=['A', 'B', 'C'])
+
+
+class _Tensor(object):
+    """A minimal framework tensor that counts the elements converted to numpy."""
+
+    def __init__(self, data, counter=None):
+        self._data = data
+        self.counter = counter if counter is not None else [0]
+
+    @property
+    def shape(self):
+        return self._data.shape
+
+    def __getitem__(self, key):
+        return _Tensor(self._data[key], self.counter)
+
+    def __array__(self, dtype=None, copy=None):
+        self.counter[0] += self._data.size
+        return np.asarray(self._data, dtype=dtype)
+
+
+class _ArrayInterface(object):
+
+    def __init__(self, data):
+        self.__array_interface__ = data.__array_interface__
+        self._data = data
+
+
+class _DLPack(object):
+
+    def __init__(self, data):
+        self._data = data
+
+    def __dlpack__(self, **kwargs):
+        return self._data.__dlpack__(**kwargs)
+
+    def __dlpack_device__(self):
+        return self._data.__dlpack_device__()
+
+
+class _DataFrame(object):
+    """A minimal pandas-style frame, whose own indexing is by column label."""
+
+    def __init__(self, data):
+        self._data = data
+        self.shape = data.shape
+        self.iloc = data
+
+    def __getitem__(self, label):
+        raise KeyError(label)
+
+
+class TensorTest(unittest.TestCase):
+
+    def test_only_displayed_cells_of_tensor_are_converted(self):
+        M = np.arange(1000 * 1000).reshape(1000, 1000)
+        tensor = _Tensor(M)
+
+        actual = prettymatrix.matrix_to_string(tensor, include_dimensions=True)
+
+        self.assertEqual(prettymatrix.matrix_to_string(M, include_dimensions=True),
+                         actual)
+        self.assertEqual(36, tensor.counter[0])
+
+    def test_small_tensor(self):
+        M = np.array([[1, 2], [3, 4]])
+        tensor = _Tensor(M)
+
+        actual = prettymatrix.expression_to_string(tensor, prettymatrix.PLUS, tensor)
+
+        self.assertEqual(prettymatrix.expression_to_string(M, prettymatrix.PLUS, M),
+                         actual)
+        self.assertEqual(8, tensor.counter[0])
+
+    def test_array_interface(self):
+        M = np.arange(12 * 12).reshape(12, 12)
+        self.assertEqual(prettymatrix.matrix_to_string(M),
+                         prettymatrix.matrix_to_string(_ArrayInterface(M)))
+
+    @unittest.skipUnless(hasattr(np, 'from_dlpack'), "DLPack needs NumPy 1.22")
+    def test_dlpack(self):
+        M = np.arange(12 * 12).reshape(12, 12)
+        self.assertEqual(prettymatrix.matrix_to_string(M),
+                         prettymatrix.matrix_to_string(_DLPack(M)))
+
+    def test_data_frames_are_sliced_by_position(self):
+        M = np.arange(12 * 12).reshape(12, 12)
+        self.assertEqual(prettymatrix.matrix_to_string(M),
+                         prettymatrix.matrix_to_string(_DataFrame(M)))
+
+
+class _Dataset(object):
+    """A minimal HDF5-style dataset that records every read."""
+
+    def __init__(self, data):
+        self._data = data
+        self.shape = data.shape
+        self.reads = []
+
+    def __getitem__(self, key):
+        self.reads.append(key)
+        return self._data[key]
+
+
+class _ZarrArray(_Dataset):
+    """A minimal Zarr-style array supporting orthogonal selection."""
+
+    __module__ = 'zarr.core'
+
+    def get_orthogonal_selection(self, selection):
+        self.reads.append(selection)
+        rows, cols = selection
+        return self._data[np.ix_(rows, cols)]
+
+
+class ReaderTest(unittest.TestCase):
+
+    def test_dataset_is_read_once_per_displayed_block(self):
+        M = np.arange(50 * 40).reshape(50, 40)
+        dataset = _Dataset(M)
+
+        actual = prettymatrix.matrix_to_string(dataset, include_dimensions=True)
+
+        self.assertEqual(prettymatrix.matrix_to_string(M, include_dimensions=True),
+                         actual)
+        self.assertEqual([(slice(0, 3), slice(0, 3)),
+                          (slice(0, 3), slice(37, 40)),
+                          (slice(47, 50), slice(0, 3)),
+                          (slice(47, 50), slice(37, 40))],
+                         dataset.reads)
+
+    def test_zarr_array_is_read_in_one_selection(self):
+        M = np.arange(50 * 40).reshape(50, 40)
+        array = _ZarrArray(M)
+
+        actual = prettymatrix.matrix_to_string(array)
+
+        self.assertEqual(prettymatrix.matrix_to_string(M), actual)
+        self.assertEqual(1, len(array.reads))
+
+    def test_registered_reader_takes_precedence(self):
+        calls = []
+
+        def read_blocks(M, row_slices, col_slices):
+            calls.append((row_slices, col_slices))
+            return np.full((2, 6), 'x')
+
+        with mock.patch.object(prettymatrix, '_READERS', list(prettymatrix._READERS)):
+            prettymatrix.register_reader(lambda M: isinstance(M, _Dataset),
+                                         read_blocks)
+            actual = prettymatrix.matrix_to_string(_Dataset(np.zeros((2, 20))))
+
+        expected = (
+            "┌                   ┐\n"
+            "│ x x x … … … x x x │\n"
+            "│ x x x … … … x x x │\n"
+            "└                   ┘"
+        )
+        self.assertEqual(expected, actual)
+        self.assertEqual([([slice(0, 2)], [slice(0, 3), slice(17, 20)])], calls)
+
+
+class MainTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+
+    def _main(self, *paths):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            status = prettymatrix.main([os.path.join(self.directory, path)
+                                        for path in paths])
+        self.assertEqual(0, status)
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_npy_file_is_memory_mapped(self):
+        M = np.arange(100 * 100).reshape(100, 100)
+        np.save(os.path.join(self.directory, 'M.npy'), M)
+
+        [(name, mapped)] = prettymatrix._load(os.path.join(self.directory, 'M.npy'))
+        stdout, stderr = self._main('M.npy')
+
+        self.assertEqual('M.npy', name)
+        self.assertIsInstance(mapped, np.memmap)
+        self.assertEqual(prettymatrix.matrix_to_string(M, name='M.npy',
+                                                       include_dimensions=True) + '\n',
+                         stdout)
+        self.assertIn('M.npy: loaded in', stderr)
+
+    def test_uncompressed_npz_members_are_memory_mapped(self):
+        M = np.arange(12.).reshape(3, 4)
+        N = np.asfortranarray(np.arange(200).reshape(20, 10))
+        np.savez(os.path.join(self.directory, 'arrays.npz'), M=M, N=N)
+
+        loaded = prettymatrix._load(os.path.join(self.directory, 'arrays.npz'))
+        stdout, stderr = self._main('arrays.npz')
+
+        self.assertEqual(['M', 'N'], [name for name, _ in loaded])
+        for _, mapped in loaded:
+            self.assertIsInstance(mapped, np.memmap)
+        np.testing.assert_array_equal(M, loaded[0][1])
+        np.testing.assert_array_equal(N, loaded[1][1])
+        self.assertEqual(
+            prettymatrix.matrix_to_string(M, name='M', include_dimensions=True) + '\n' +
+            prettymatrix.matrix_to_string(N, name='N', include_dimensions=True) + '\n',
+            stdout)
+        self.assertIn('N: loaded in', stderr)
+
+    def test_csv_file(self):
+        with open(os.path.join(self.directory, 'M.csv'), 'w') as f:
+            f.write("1,2\n")
+
+        stdout, _ = self._main('M.csv')
+
+        expected = (
+            "M.csv  \n"
+            "(1x2)  \n"
+            "┌     ┐\n"
+            "│ 1 2 │\n"
+            "└     ┘\n"
+        )
+        self.assertEqual(expected, stdout)
+
+    def test_compressed_npz_members_are_loaded(self):
+        np.savez_compressed(os.path.join(self.directory, 'arrays.npz'), v=np.arange(3))
+
+        stdout, _ = self._main('arrays.npz')
+
+        expected = (
+            "v        \n"
+            "(1x3)    \n"
+            "┌       ┐\n"
+            "│ 0 1 2 │\n"
+            "└       ┘\n"
+        )
+        self.assertEqual(expected, stdout)
+
+    def test_arrays_with_more_than_two_dimensions_are_stacked(self):
+        T = np.arange(24).reshape(2, 3, 4)
+        np.savez(os.path.join(self.directory, 'arrays.npz'), T=T, v=np.arange(2))
+
+        stdout, _ = self._main('arrays.npz')
+
+        expected = (
+            prettymatrix.matrix_to_string(T.reshape(6, 4), name='T (2x3x4)',
+                                          include_dimensions=True) + '\n' +
+            prettymatrix.matrix_to_string(np.arange(2).reshape(1, 2), name='v',
+                                          include_dimensions=True) + '\n')
+        self.assertEqual(expected, stdout)
+
+    def test_non_contiguous_arrays_are_split_rather_than_copied(self):
+        T = np.asfortranarray(np.arange(24).reshape(2, 3, 4))
+        np.save(os.path.join(self.directory, 'T.npy'), T)
+
+        stdout, _ = self._main('T.npy')
+
+        expected = (
+            prettymatrix.matrix_to_string(T[0], name='T.npy[0]',
+                                          include_dimensions=True) + '\n' +
+            prettymatrix.matrix_to_string(T[1], name='T.npy[1]',
+                                          include_dimensions=True) + '\n')
+        self.assertEqual(expected, stdout)
+
+    def test_empty_arrays_are_skipped(self):
+        np.savez(os.path.join(self.directory, 'arrays.npz'),
+                 E=np.zeros((2, 0, 3)), v=np.arange(2))
+
+        stdout, stderr = self._main('arrays.npz')
+
+        self.assertEqual(prettymatrix.matrix_to_string(
+            np.arange(2).reshape(1, 2), name='v', include_dimensions=True) + '\n',
+            stdout)
+        self.assertIn('E (2x0x3): empty, skipped', stderr)
+
+    def test_npy_ending_like_a_zip_archive(self):
+        # An end of central directory record, as zipfile.is_zipfile looks for.
+        M = np.frombuffer(b'PK\x05\x06' + bytes(18), dtype=np.uint8).reshape(2, 11)
+        np.save(os.path.join(self.directory, 'M.npy'), M)
+
+        stdout, _ = self._main('M.npy')
+
+        self.assertEqual(prettymatrix.matrix_to_string(
+            M, name='M.npy', include_dimensions=True) + '\n', stdout)
+
+    def test_npz_object_members_are_not_unpickled(self):
+        path = os.path.join(self.directory, 'objects.npz')
+        np.savez(path, a=np.array([[1, 'x']], dtype=object))
+
+        with self.assertRaises(ValueError):
+            prettymatrix._load(path)
+
+    def test_npz_members_in_later_formats_are_loaded(self):
+        M = np.arange(6).reshape(2, 3)
+        path = os.path.join(self.directory, 'arrays.npz')
+        with zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED) as archive:
+            with archive.open('M.npy', 'w') as f:
+                np.lib.format.write_array(f, M, version=(3, 0))
+
+        [(name, loaded)] = prettymatrix._load(path)
+
+        self.assertEqual('M', name)
+        self.assertNotIsInstance(loaded, np.memmap)
+        np.testing.assert_array_equal(M, loaded)
+
+
+class ReadTextTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'M.csv')
+
+    def _write(self, text):
+        with open(self.path, 'w') as f:
+            f.write(text)
+
+    def test_small_matrix(self):
+        expected = (
+            "(2x3)    \n"
+            "┌       ┐\n"
+            "│ 1 2 3 │\n"
+            "│ 4 5 6 │\n"
+            "└       ┘"
+        )
+        self._write("1,2, 3\n4,5,6\n")
+        actual = prettymatrix.matrix_to_string(prettymatrix.read_text(self.path),
+                                               include_dimensions=True)
+        self.assertEqual(expected, actual)
+
+    def test_large_matrix_matches_array(self):
+        M = np.arange(40 * 25).reshape(40, 25)
+        np.savetxt(self.path, M, delimiter='\t', fmt='%d')
+
+        with mock.patch.object(prettymatrix, '_TEXT_BLOCK_SIZE', 16):
+            actual = prettymatrix.matrix_to_string(
+                prettymatrix.read_text(self.path, delimiter='\t'),
+                include_dimensions=True)
+
+        self.assertEqual(prettymatrix.matrix_to_string(M, include_dimensions=True),
+                         actual)
+
+    def test_whitespace_delimiter_without_trailing_newline(self):
+        M = np.arange(12 * 2).reshape(12, 2)
+        self._write('\n'.join('{}  {}'.format(*row) for row in M))
+
+        actual = prettymatrix.matrix_to_string(
+            prettymatrix.read_text(self.path, delimiter=None),
+            include_dimensions=True)
+
+        self.assertEqual(prettymatrix.matrix_to_string(M, include_dimensions=True),
+                         actual)
+
+    def test_middle_of_file_is_not_parsed_when_rows_are_given(self):
+        lines = ['1,2'] * 11 + ['not a row'] * 100 + ['3,4'] * 3
+        self._write('\n'.join(lines) + '\n')
+
+        M = prettymatrix.read_text(self.path, num_rows=114)
+
+        self.assertEqual((114, 2), M.shape)
+        self.assertEqual([['3', '4']], M[113:114, 0:2].tolist())
+        with self.assertRaises(IndexError):
+            M[50:51, 0:2]
+
+    def test_empty_file(self):
+        self._write("")
+
+        M = prettymatrix.read_text(self.path)
+
+        self.assertEqual((0, 0), M.shape)
+        self.assertEqual("(0x0)", prettymatrix.matrix_to_string(
+            M, include_dimensions=True).split('\n')[0].rstrip())
+
+    def test_trailing_blank_lines_are_not_rows(self):
+        for num_rows in (2, 10, 20):
+            self._write("1,2\n" * num_rows + "\n\r\n")
+
+            with mock.patch.object(prettymatrix, '_TEXT_BLOCK_SIZE', 3):
+                M = prettymatrix.read_text(self.path)
+
+            self.assertEqual((num_rows, 2), M.shape)
+            self.assertEqual(
+                prettymatrix.matrix_to_string(np.tile([1, 2], (num_rows, 1))),
+                prettymatrix.matrix_to_string(M))
+
+    def test_summaries_are_unsupported(self):
+        self._write("1,2\n3,4\n")
+        M = prettymatrix.read_text(self.path)
+
+        with self.assertRaises(TypeError):
+            prettymatrix.matrix_to_string(M, margins=('max',))
+        with self.assertRaises(TypeError):
+            prettymatrix.heatmap_to_string(M)
+
+    def test_malformed_row(self):
+        self._write("1,2,3\n4,5\n")
+        with self.assertRaises(ValueError):
+            prettymatrix.read_text(self.path)
+
+
+class LayoutTest(unittest.TestCase):
+
+    def test_text_matches_expression_to_string(self):
+        M = np.array([['1', '22'], ['333', '4444']])
+        expected = prettymatrix.expression_to_string(M, prettymatrix.DOT, M,
+                                                     names=['M', 'N'],
+                                                     include_dimensions=True)
+        actual = prettymatrix.layout(M, prettymatrix.DOT, M, names=['M', 'N'],
+                                     include_dimensions=True).render('text')
+        self.assertEqual(expected, actual)
+        self.assertEqual(expected, str(prettymatrix.layout(
+            M, prettymatrix.DOT, M, names=['M', 'N'], include_dimensions=True)))
+
+    def test_names_are_not_modified(self):
+        names = ['M', 'N']
+        prettymatrix.layout(np.full((1, 1), '0'), prettymatrix.PLUS,
+                            np.full((1, 1), '0'), names=names)
+        self.assertEqual(['M', 'N'], names)
+
+    def test_html(self):
+        actual = prettymatrix.layout(np.array([['<1>']]), names=['M']).render('html')
+
+        self.assertTrue(actual.startswith('<div class="prettymatrix"'))
+        self.assertIn('<div>M</div>', actual)
+        self.assertIn('>&lt;1&gt;</td>', actual)
+
+    def test_latex(self):
+        expected = (
+            r"\overset{\substack{\text{M\_1} \\ \text{(2x1)}}}"
+            r"{\begin{bmatrix} 1 \\ 2 \end{bmatrix}} \cdot "
+            r"\overset{\substack{\text{(1x1)}}}{\begin{bmatrix} 3 \end{bmatrix}}"
+        )
+        actual = prettymatrix.layout(np.array([[1], [2]]), prettymatrix.DOT,
+                                     np.array([[3]]), names=['M_1'],
+                                     include_dimensions=True).render('latex')
+        self.assertEqual(expected, actual)
+
+    def test_latex_ellipses(self):
+        actual = prettymatrix.layout(np.zeros((11, 11), dtype=int)).render('latex')
+
+        self.assertIn(r"0 & 0 & 0 & \cdots & 0 & 0 & 0 \\", actual)
+        self.assertIn(r"\vdots & \vdots & \vdots & \ddots & \vdots & \vdots & \vdots \\",
+                      actual)
+        self.assertEqual(1, actual.count(r"\ddots"))
+        self.assertEqual(7, actual.count(r"\\") + 1)
+
+    def test_latex_text_mode_characters(self):
+        expected = (
+            r"\overset{\substack{\text{a\textasciicircum{}b\textasciitilde{}}}}"
+            r"{\begin{bmatrix} \text{x\textbackslash{}y} & 1 \end{bmatrix}}"
+        )
+        actual = prettymatrix.layout(np.array([['x\\y', '1']]),
+                                     names=['a^b~']).render('latex')
+        self.assertEqual(expected, actual)
+
+    def test_markdown(self):
+        expected = (
+            "M\n"
+            "\n"
+            "|     |      |\n"
+            "| --- | ---- |\n"
+            "| 1   | 22   |\n"
+            "| 333 | 4\\|4 |\n"
+            "\n"
+            "+"
+        )
+        actual = prettymatrix.layout(np.array([['1', '22'], ['333', '4|4']]),
+                                     prettymatrix.PLUS, names=['M']).render('markdown')
+        self.assertEqual(expected, actual)
+
+    def test_matrices_are_formatted_once_for_every_backend(self):
+        M = np.arange(4).reshape(2, 2)
+
+        with mock.patch.object(prettymatrix, '_format_matrix',
+                               wraps=prettymatrix._format_matrix) as format_matrix:
+            layout = prettymatrix.layout(M, prettymatrix.PLUS, M)
+            text = layout.render('text')
+            rendered = [layout.render(backend) for backend in
+                        ('text', 'html', 'latex', 'markdown', 'html')]
+
+        self.assertEqual(2, format_matrix.call_count)
+        self.assertIs(text, rendered[0])
+        self.assertIs(rendered[1], rendered[4])
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            prettymatrix.layout(np.zeros((1, 1))).render('rtf')
+
+
+class PrettyMatrixTest(unittest.TestCase):
+
+    def test_representations(self):
+        M = np.array([[1, 2], [3, 4]])
+        pretty = prettymatrix.PrettyMatrix(M, prettymatrix.PLUS, M, names=['M', 'M'])
+        printer = mock.Mock()
+
+        pretty._repr_pretty_(printer, cycle=False)
+
+        expected = prettymatrix.layout(M, prettymatrix.PLUS, M, names=['M', 'M'])
+        printer.text.assert_called_once_with(expected.render('text'))
+        self.assertEqual(expected.render('text'), str(pretty))
+        self.assertEqual(expected.render('html'), pretty._repr_html_())
+        self.assertEqual('$${}$$'.format(expected.render('latex')),
+                         pretty._repr_latex_())
+
+    def test_layout_is_built_once_per_data_version(self):
+        M = np.zeros((20, 20))
+        pretty = prettymatrix.PrettyMatrix(M)
+
+        with mock.patch.object(prettymatrix, 'layout',
+                               wraps=prettymatrix.layout) as layout:
+            first = pretty._repr_html_()
+            pretty._repr_latex_()
+            str(pretty)
+            self.assertEqual(1, layout.call_count)
+
+            M[10, 10] = 1
+            self.assertIs(first, pretty._repr_html_())
+            self.assertEqual(1, layout.call_count)
+
+            M[0, 0] = np.nan
+            self.assertIn('nan', str(pretty))
+            pretty._repr_html_()
+            self.assertEqual(2, layout.call_count)
+
+    def test_wrapped_operands_are_fingerprinted_without_evaluating(self):
+        A = np.ones((2, 3))
+        pretty = prettymatrix.PrettyMatrix(prettymatrix.inv(A), names=['A'])
+
+        with mock.patch.object(np.linalg, 'inv') as inverse:
+            first = str(pretty)
+            A[0, 0] = 100
+            second = str(pretty)
+
+        inverse.assert_not_called()
+        self.assertEqual(prettymatrix.expression_to_string(
+            prettymatrix.inv(A), names=['A']), second)
+        self.assertNotEqual(first, second)
+
+    def test_evaluated_inverse_follows_its_operand(self):
+        A = np.eye(2)
+        pretty = prettymatrix.PrettyMatrix(prettymatrix.inv(A), evaluate=True)
+        str(pretty)
+
+        A[0, 0] = 4
+
+        self.assertIn('0.25', str(pretty))
+
+    def test_colour(self):
+        M = np.zeros((2, 3))
+        pretty = prettymatrix.PrettyMatrix(M, prettymatrix.DOT, M.T,
+                                           include_dimensions=True, colour=True)
+
+        self.assertEqual(prettymatrix.expression_to_string(
+            M, prettymatrix.DOT, M.T, include_dimensions=True, colour=True),
+            str(pretty))
+
+    def test_objects_mutated_in_place_are_redrawn(self):
+        M = np.empty((1, 1), dtype=object)
+        M[0, 0] = [1]
+        pretty = prettymatrix.PrettyMatrix(M)
+        str(pretty)
+
+        M[0, 0].append(2)
+
+        self.assertIn('[1, 2]', str(pretty))
+
+
+class ColourTest(unittest.TestCase):
+
+    def test_matching_dimensions_share_a_colour(self):
+        red, green = '\x1b[31m', '\x1b[32m'
+        reset = '\x1b[0m'
+        expected_dimensions = (
+            "(" + red + "2" + reset + "x" + green + "3" + reset + ")" + "       " +
+            "(" + green + "3" + reset + "x" + red + "2" + reset + ")" + "     " +
+            "(" + red + "2" + reset + "x" + red + "2" + reset + ")" + "  "
+        )
+        actual = prettymatrix.expression_to_string(
+            np.full((2, 3), '0'), prettymatrix.DOT, np.full((3, 2), '0'),
+            prettymatrix.EQUALS, np.full((2, 2), '0'),
+            include_dimensions=True, colour=True)
+
+        self.assertEqual(expected_dimensions, actual.split('\n')[0])
+
+    def test_coloured_output_aligns_with_monochrome_output(self):
+        seq = (np.full((2, 3), '0'), prettymatrix.DOT, np.full((3, 12), '00'))
+        coloured = prettymatrix.expression_to_string(*seq, names=['A', 'B'],
+                                                     include_dimensions=True,
+                                                     colour=True)
+        monochrome = prettymatrix.expression_to_string(*seq, names=['A', 'B'],
+                                                       include_dimensions=True)
+
+        self.assertNotEqual(monochrome, coloured)
+        self.assertEqual(monochrome, re.sub('\x1b\\[[0-9;]*m', '', coloured))
+
+    def test_colour_without_dimensions_is_monochrome(self):
+        M = np.full((2, 2), '0')
+        self.assertEqual(prettymatrix.expression_to_string(M, prettymatrix.PLUS, M),
+                         prettymatrix.expression_to_string(M, prettymatrix.PLUS, M,
+                                                           colour=True))
+
+    def test_escape_sequences_have_no_width(self):
+        self.assertEqual(['\x1b[31ma', 'b\x1b[0m'],
+                         prettymatrix._characters('\x1b[31mab\x1b[0m'))
+        self.assertEqual(2, prettymatrix._visible_len('\x1b[31mab\x1b[0m'))
+
+
+class NodeTest(unittest.TestCase):
+
+    def test_transpose_notation(self):
+        expected = (
+            "A      \n"
+            "(2x1)  \n"
+            "┌   ┐ ᵀ\n"
+            "│ 1 │  \n"
+            "│ 2 │  \n"
+            "└   ┘  "
+        )
+        M = np.array([['1'], ['2']])
+        actual = prettymatrix.expression_to_string(prettymatrix.T(M), names=['A'],
+                                                   include_dimensions=True)
+        self.assertEqual(expected, actual)
+
+    def test_evaluated_transpose(self):
+        expected = (
+            "Aᵀ     \n"
+            "(1x2)  \n"
+            "┌     ┐\n"
+            "│ 1 2 │\n"
+            "└     ┘"
+        )
+        M = np.array([['1'], ['2']])
+        actual = prettymatrix.expression_to_string(prettymatrix.T(M), names=['A'],
+                                                   include_dimensions=True,
+                                                   evaluate=True)
+        self.assertEqual(expected, actual)
+
+    def test_function_notation(self):
+        expected = (
+            "tanh( ┌   ┐ ) + ┌   ┐\n"
+            "      │ 0 │     │ 0 │\n"
+            "      └   ┘     └   ┘"
+        )
+        M = np.array([['0']])
+        actual = prettymatrix.expression_to_string(
+            prettymatrix.apply('tanh', M), prettymatrix.PLUS, M)
+        self.assertEqual(expected, actual)
+
+    def test_nested_notation(self):
+        M = np.array([[0.0]])
+        node = prettymatrix.T(prettymatrix.apply('exp', M))
+
+        self.assertTrue(prettymatrix.expression_to_string(node).startswith(
+            "exp( ┌     ┐ )ᵀ\n"))
+        self.assertTrue(prettymatrix.expression_to_string(
+            node, names=['M'], evaluate=True).startswith("exp(M)ᵀ"))
+        self.assertIn(r"\end{bmatrix} )^{T}",
+                      prettymatrix.layout(node).render('latex'))
+
+    def test_transpose_reads_only_displayed_cells(self):
+        M = np.arange(1000 * 500).reshape(1000, 500)
+        tensor = _Tensor(M)
+
+        actual = prettymatrix.matrix_to_string(prettymatrix.T(tensor))
+
+        self.assertEqual(prettymatrix.matrix_to_string(M.T), actual)
+        self.assertEqual(36, tensor.counter[0])
+
+    def test_function_is_applied_only_to_displayed_cells(self):
+        M = np.arange(1000 * 500).reshape(1000, 500) / 1000
+        evaluated = []
+
+        def square(x):
+            evaluated.append(x.size)
+            return x ** 2
+
+        actual = prettymatrix.matrix_to_string(prettymatrix.apply(square, M))
+
+        self.assertEqual(prettymatrix.matrix_to_string(M ** 2), actual)
+        self.assertEqual(36, sum(evaluated))
+
+    def test_inverse(self):
+        M = np.array([[2.0, 0.0], [0.0, 4.0]])
+        self.assertEqual(prettymatrix.matrix_to_string(np.linalg.inv(M)),
+                         prettymatrix.matrix_to_string(prettymatrix.inv(M)))
+        self.assertTrue(prettymatrix.expression_to_string(
+            prettymatrix.inv(M), names=['M'], evaluate=True).startswith("M⁻¹"))
+
+    def test_masks_survive_transpose_and_functions(self):
+        expected = (
+            "┌         ┐\n"
+            "│ 1.0 3.0 │\n"
+            "│ --  4.0 │\n"
+            "└         ┘"
+        )
+        M = np.ma.masked_array([[1., 2.], [3., 4.]], mask=[[0, 1], [0, 0]])
+
+        self.assertEqual(expected, prettymatrix.expression_to_string(
+            prettymatrix.T(M), evaluate=True))
+        self.assertIn('--', prettymatrix.expression_to_string(
+            prettymatrix.apply('sqrt', M), evaluate=True))
+
+    def test_complex_inverse(self):
+        expected = (
+            "┌                   ┐\n"
+            "│ 0.0-1.0j 0.0+0.0j │\n"
+            "│ 0.0+0.0j 0.5+0.0j │\n"
+            "└                   ┘"
+        )
+        actual = prettymatrix.expression_to_string(
+            prettymatrix.inv(np.array([[1j, 0], [0, 2]])), evaluate=True)
+        self.assertEqual(expected, actual)
+
+
+class FormatterTest(unittest.TestCase):
+
+    def test_complex_matrix(self):
+        expected = (
+            "┌                   ┐\n"
+            "│ 1.0+2.0j 3.0-4.0j │\n"
+            "└                   ┘"
+        )
+        actual = prettymatrix.matrix_to_string(np.array([[1 + 2j, 3 - 4j]]))
+        self.assertEqual(expected, actual)
+
+    def test_masked_cells_are_hidden(self):
+        expected = (
+            "┌       ┐\n"
+            "│ 1  -- │\n"
+            "│ -- 4  │\n"
+            "└       ┘"
+        )
+        M = np.ma.masked_array([[1, 2], [3, 4]], mask=[[0, 1], [1, 0]])
+        actual = prettymatrix.matrix_to_string(M)
+        self.assertEqual(expected, actual)
+
+    def test_masked_cells_are_hidden_in_large_matrix(self):
+        M = np.ma.masked_greater(np.arange(144).reshape(12, 12), 140)
+        actual = prettymatrix.matrix_to_string(M)
+        self.assertIn("│ 132 133 134 … … … --  --  --  │", actual)
+
+    def test_object_matrix(self):
+        expected = (
+            "┌                        ┐\n"
+            "│ 1/3 1.10 0.0+2.0j None │\n"
+            "└                        ┘"
+        )
+        M = np.array([[fractions.Fraction(1, 3), decimal.Decimal('1.10'), 2j, None]],
+                     dtype=object)
+        actual = prettymatrix.matrix_to_string(M)
+        self.assertEqual(expected, actual)
+
+    def test_registered_formatter_applies_to_subclasses(self):
+        class Money(decimal.Decimal):
+            pass
+
+        self.addCleanup(prettymatrix._object_formatter.cache_clear)
+        with mock.patch.dict(prettymatrix._OBJECT_FORMATTERS):
+            prettymatrix.register_formatter(decimal.Decimal,
+                                            lambda x: '{:.2f}'.format(x))
+            actual = prettymatrix.matrix_to_string(
+                np.array([[Money('1.5'), decimal.Decimal('2')]], dtype=object))
+
+        expected = (
+            "┌           ┐\n"
+            "│ 1.50 2.00 │\n"
+            "└           ┘"
+        )
+        self.assertEqual(expected, actual)
+
+    def test_formatters_are_looked_up_once_per_type(self):
+        prettymatrix._object_formatter.cache_clear()
+        M = np.full((20, 20), fractions.Fraction(1, 2), dtype=object)
+
+        prettymatrix.matrix_to_string(M)
+
+        self.assertEqual(1, prettymatrix._object_formatter.cache_info().misses)
+
+
+class ThreadSafetyTest(unittest.TestCase):
+
+    def test_printoptions(self):
+        expected = (
+            "┌                   ┐\n"
+            "│ 0 1 2 … … … 4 5 6 │\n"
+            "│ 1 2 3 … … … 5 6 7 │\n"
+            "│ 2 3 4 … … … 6 7 8 │\n"
+            "│ 3 4 5 … … … 7 8 9 │\n"
+            "└                   ┘"
+        )
+        M = np.add.outer(np.arange(4), np.arange(7))
+        with prettymatrix.printoptions(max_width=6):
+            actual = prettymatrix.matrix_to_string(M)
+
+        self.assertEqual(expected, actual)
+        self.assertNotIn('…', prettymatrix.matrix_to_string(M))
+
+    def test_invalid_printoptions(self):
+        with self.assertRaises(ValueError):
+            with prettymatrix.printoptions(max_width=5):
+                pass
+
+    def test_printoptions_apply_only_to_current_thread(self):
+        M = np.arange(24).reshape(12, 2)
+        inside = threading.Event()
+        rendered = threading.Event()
+        results = {}
+
+        def render_with_options():
+            with prettymatrix.printoptions(max_height=12):
+                inside.set()
+                rendered.wait()
+                results['inside'] = prettymatrix.matrix_to_string(M)
+
+        thread = threading.Thread(target=render_with_options)
+        thread.start()
+        inside.wait()
+        results['outside'] = prettymatrix.matrix_to_string(M)
+        rendered.set()
+        thread.join()
+
+        self.assertIn('…', results['outside'])
+        self.assertNotIn('…', results['inside'])
+
+    def test_concurrent_rendering_matches_sequential(self):
+        random = np.random.RandomState(0)
+        matrices = [random.normal(size=(size, size + 5))
+                    for size in range(1, 40)]
+
+        def render(M):
+            return prettymatrix.matrix_to_string(M, name='M', margins=('mean',),
+                                                 markers=True)
+
+        expected = [render(M) for M in matrices]
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            actual = list(executor.map(render, matrices * 4))
+
+        self.assertEqual(expected * 4, actual)
+
+    def test_layout_rendered_concurrently_is_cached_once(self):
+        layout = prettymatrix.layout(np.eye(3), names=['I'])
+
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            rendered = list(executor.map(lambda _: layout.render('html'),
+                                         range(32)))
+
+        self.assertTrue(all(html is rendered[0] for html in rendered))
+
+    def test_formatter_registered_while_rendering(self):
+        self.addCleanup(prettymatrix._object_formatter.cache_clear)
+        M = np.full((20, 20), fractions.Fraction(1, 2), dtype=object)
+
+        with mock.patch.dict(prettymatrix._OBJECT_FORMATTERS):
+            with futures.ThreadPoolExecutor(max_workers=4) as executor:
+                pending = [executor.submit(prettymatrix.matrix_to_string, M)
+                           for _ in range(16)]
+                prettymatrix.register_formatter(fractions.Fraction,
+                                                lambda x: '{:.1f}'.format(float(x)))
+                results = [future.result() for future in pending]
+            actual = prettymatrix.matrix_to_string(M)
+
+        self.assertTrue(all('1/2' in result or '0.5' in result
+                            for result in results))
+        self.assertIn('0.5', actual)
+        self.assertNotIn('1/2', actual)
+
+
+class PeakMemoryTest(unittest.TestCase):
+    """Rendering a large memmap must allocate in proportion to displayed cells.
+
+    A single row of the matrix is larger than the ceiling, so any copy of a
+    whole row, or of the full matrix, while capping fails these tests.
+    """
+
+    CEILING = 64 * 1024
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.M = np.memmap(os.path.join(cls.directory.name, 'M.dat'),
+                          dtype=np.uint8, mode='w+', shape=(1000, 100000))
+        cls.M[0, 0], cls.M[-1, -1] = 1, 2
+
+    @classmethod
+    def tearDownClass(cls):
+        del cls.M
+        cls.directory.cleanup()
+
+    def _peak(self, render):
+        render()  # Leave one-off caches and imports out of the measurement.
+
+        tracemalloc.start()
+        try:
+            result = render()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return result, peak
+
+    def test_matrix_to_string(self):
+        actual, peak = self._peak(lambda: prettymatrix.matrix_to_string(
+            self.M, name='M', include_dimensions=True))
+
+        self.assertLess(peak, self.CEILING)
+        self.assertIn('│ 1 0 0 … … … 0 0 0 │', actual)
+        self.assertIn('│ 0 0 0 … … … 0 0 2 │', actual)
+
+    def test_matrices_to_string(self):
+        actual, peak = self._peak(lambda: prettymatrix.matrices_to_string(
+            self.M, self.M, names=['A', 'B'], include_dimensions=True))
+
+        self.assertLess(peak, self.CEILING)
+        self.assertEqual(2, actual.count('│ 1 0 0 … … … 0 0 0 │'))
+
+    def test_expression_to_string(self):
+        actual, peak = self._peak(lambda: prettymatrix.expression_to_string(
+            prettymatrix.T(self.M), prettymatrix.PLUS, self.M,
+            names=['A', 'B'], include_dimensions=True))
+
+        self.assertLess(peak, self.CEILING)
+        self.assertEqual(2, actual.count('│ 1 0 0 … … … 0 0 0 │'))
+
+
 if __name__ == "__main__":
     unittest.main()